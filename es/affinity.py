@@ -0,0 +1,49 @@
+import os
+import fcntl
+
+# thread pools of numerical libraries in the worker and the simulation children it forks
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+
+def _set_process_affinity(cores):
+    # sched_setaffinity(0) only pins the calling thread, pin every thread of the process
+    for tid in os.listdir('/proc/self/task'):
+        try:
+            os.sched_setaffinity(int(tid), cores)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+
+def pin_worker(num_cores, lock_dir='/tmp/tunercar_cores'):
+    """
+    Pins the calling worker process to its own set of num_cores cores of the node, simulation
+    children forked afterwards inherit the affinity and the thread limits
+
+    Workers on a node claim core slots with a lock file per slot, a lock is released by the
+    kernel when its worker exits, so slots of killed workers are reused.
+
+    Args:
+        num_cores (int): cores per worker
+        lock_dir (str): node local directory of the slot lock files
+
+    Returns:
+        cores (list[int]): cores of the worker, None if all slots of the node are taken
+        lock (int): file descriptor holding the slot, keep it open for the life of the worker
+    """
+    available = sorted(os.sched_getaffinity(0))
+    num_slots = len(available) // num_cores
+    os.makedirs(lock_dir, exist_ok=True)
+    for slot in range(num_slots):
+        lock = os.open(os.path.join(lock_dir, 'slot_' + str(num_cores) + '_' + str(slot) + '.lock'), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(lock)
+            continue
+        cores = available[slot * num_cores:(slot + 1) * num_cores]
+        _set_process_affinity(cores)
+        for name in THREAD_ENV_VARS:
+            os.environ[name] = str(num_cores)
+        return cores, lock
+    print('No free core slot of ' + str(num_cores) + ' cores on this node, worker is not pinned')
+    return None, None
@@ -13,6 +13,6 @@ def default():
 
 @ex.automain
 def run(_run, _config):
-    ray.init()
+    ray.init(address=_config['ray_address'])
     conf = Namespace(**_config)
     run_arch_fdm(conf, _run)
\ No newline at end of file
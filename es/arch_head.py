@@ -1,11 +1,13 @@
 import nevergrad as ng
 import numpy as np
-from tqdm import tqdm
 import ray
-import multiprocessing as mp
 from argparse import Namespace
 
 from arch_worker import ArchWorker
+from quad_worker import QuadWorker
+from scheduler import Scheduler
+from worker_pool import WorkerPool, WorkerBroker, get_num_workers
+from artifact_store import run_name
 
 def run_arch_fdm(conf: Namespace, _run=None):
     # seeding
@@ -22,7 +24,8 @@ def run_arch_fdm(conf: Namespace, _run=None):
     if not os.path.exists(conf.base_folder):
         os.makedirs(conf.base_folder)
 
-    num_cores = conf.num_meta_workers
+    # num_meta_workers caps the pool, null uses the whole cluster
+    num_workers = get_num_workers(conf, conf.num_meta_workers)
 
     # setting up parameter space, choice for meta optimization
     param = ng.p.Dict(
@@ -38,73 +41,114 @@ def run_arch_fdm(conf: Namespace, _run=None):
             chain_optims.append(eval('ng.optimizers.' + name))
         chain = ng.optimizers.Chaining(chain_optims, conf.optim_params['chain_budget'])
         # chain = ng.optimizers.Chaining([ng.optimizers.PortfolioDiscreteOnePlusOne, ng.optimizers.CMA], ['third'])
-        optim = chain(parametrization=param, budget=conf.budget, num_workers=num_cores)
+        optim = chain(parametrization=param, budget=conf.budget, num_workers=num_workers)
     else:
-        optim = ng.optimizers.registry[conf.optim_method](parametrization=param, budget=conf.meta_budget, num_workers=num_cores)
+        optim = ng.optimizers.registry[conf.optim_method](parametrization=param, budget=conf.meta_budget, num_workers=num_workers)
 
     # seeding
     optim.parametrization.random_state = np.random.RandomState(conf.seed)
     print('Optimizer: ', optim)
 
     # setting up workers
-    workers = [ArchWorker.remote(conf, worker_id) for worker_id in range(num_cores)]
+    conf.artifact_run = run_name([filename])
+    if conf.nested:
+        # meta workers only run the inner optimizers, the inner QuadWorkers share the rest of the cluster
+        pool = WorkerPool(ArchWorker, conf, num_workers, cpus_per_worker=conf.meta_cpus_per_worker)
+        num_inner_workers = max(get_num_workers(conf) - int(np.ceil(num_workers * conf.meta_cpus_per_worker / conf.cpus_per_eval)), 1)
+        inner_pool = WorkerPool(QuadWorker, conf, num_inner_workers)
+        # the broker recycles the inner workers, they run most of the evaluations
+        broker = WorkerBroker.remote(inner_pool.workers, inner_pool, conf.recycle_after, conf.max_worker_rss_mb)
+        print('Nested search: ' + str(num_workers) + ' meta workers sharing ' + str(num_inner_workers) + ' inner workers')
+    else:
+        pool = WorkerPool(ArchWorker, conf, num_workers)
+    workers = pool.workers
 
     # all scores
     all_scores = []
     all_individuals = []
     all_vectors = []
+    # eval id of the best inner evaluation of every topology, nested search only
+    all_inner_ids = []
 
-    # work distribution loop
     eval_id = 0
-    for prog in tqdm(range(conf.budget // num_cores)):
-        individuals = [optim.ask() for _ in range(num_cores)]
-        results = []
-
-        # distribute
-        for ind, worker in zip(individuals, workers):
-            work = ind.args[0]
-            worker.run_sim.remote(work, eval_id)
-            eval_id += 1
-
-        # collect
-        # future_vectors = []
-        future_results = []
-        for worker in workers:
-            score = worker.collect.remote()
-            # future_vectors.append(vec)
-            future_results.append(score)
-        # future_results = [worker.collect.remote() for worker in workers]
-        results = ray.get(future_results)
-        # vectors = ray.get(future_vectors)
-
-        # update optimization, objective value is trim score
-        for ind, score in zip(individuals, results):
-            optim.tell(ind, np.sum(score))
+    def ask():
+        nonlocal eval_id
+        cand = (eval_id, optim.ask())
+        eval_id += 1
+        return cand
+
+    def submit(worker, cand):
+        eid, ind = cand
+        if conf.nested:
+            return worker.run_nested.remote(ind.args[0], eid, broker)
+        return worker.run_sim.remote(ind.args[0], eid)
+
+    def submit_copy(worker, cand):
+        # the copy gets its own eval folder
+        nonlocal eval_id
+        eid, ind = cand
+        eval_id += 1
+        return worker.run_sim.remote(ind.args[0], eval_id - 1)
+
+    def tell(cand, result):
+        eid, ind = cand
+        score = result.score
+        if conf.nested:
+            # objective value is the best path score of the inner optimization, negated to maximize
+            loss = 1600.0 - np.sum(score)
+            inner_id = result.info.get('best_inner_eval_id')
+            all_inner_ids.append(-1 if inner_id is None else inner_id)
+        else:
+            # update optimization, objective value is trim score
+            loss = np.sum(score)
+        optim.tell(ind, loss)
 
         # collect all
-        all_scores.extend(results)
-        all_individuals.extend([[ind.args[0]['base_node'], *(ind.args[0]['low_selections']), *(ind.args[0]['high_selections'])] for ind in individuals])
-        # all_vectors.extend(vectors)
-
-        if prog % 5 == 0:
-            score_all_np = np.asarray(all_scores)
-            print('Current Trim Only Best Score: ' + str(np.min(np.sum(score_all_np, axis=1))))
-            print("At index: " + str(str(np.argmin(np.sum(score_all_np, axis=1)))))
-            # vector_all_np = -1 * np.ones((len(all_vectors), len(max(all_vectors, key = lambda x: len(x)))), dtype=int)
-            # for i, j in enumerate(all_vectors):
-            #     vector_all_np[i][0:len(j)] = j
-            # vector_all_np = vector_all_np.astype(int)
-            selection_all_np = np.array(all_individuals).astype(int)
-
-            # np.savez_compressed(filename, scores=score_all_np, vectors=vector_all_np, selections=selection_all_np)
-            np.savez_compressed(filename, scores=score_all_np, selections=selection_all_np)
-            # _run.add_artifact(filename)
-            optim.dump(filename_optim)
-            # _run.add_artifact(filename_optim)
-
+        all_scores.append(score)
+        all_individuals.append([ind.args[0]['base_node'], *(ind.args[0]['low_selections']), *(ind.args[0]['high_selections'])])
+        return loss
+
+    def checkpoint():
+        _save_results(conf, optim, all_scores, all_individuals, filename, filename_optim, all_inner_ids)
+
+    # a losing copy of a nested evaluation would keep borrowing inner workers from the broker
+    # until its whole inner budget is spent, topologies are only speculated on without nesting
+    scheduler = Scheduler(workers, conf.scheduler, conf.evals_per_worker, speculative=conf.speculative and not conf.nested,
+                          recycle=pool.replace, recycle_after=conf.recycle_after, max_rss_mb=conf.max_worker_rss_mb)
+    scheduler.run(ask, submit, tell, conf.budget, checkpoint=checkpoint, checkpoint_every=5, submit_copy=submit_copy)
+
+    _save_results(conf, optim, all_scores, all_individuals, filename, filename_optim, all_inner_ids)
+    pool.shutdown()
+    if conf.nested:
+        # replacements started by the broker are owned by it, shut them down before the broker
+        inner_pool.workers = ray.get(broker.current_workers.remote())
+        inner_pool.shutdown()
+        ray.kill(broker)
+
+def _save_results(conf: Namespace, optim, all_scores, all_individuals, filename, filename_optim, all_inner_ids=None):
+    """
+    Prints the current best score, saves all evaluations as npz and dumps the optimizer
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optim (nevergrad.optimizers.base.Optimizer): optimizer to dump
+        all_scores (list[list[float]]): scores of all evaluations so far
+        all_individuals (list[list[int]]): selections of all evaluations so far
+        filename (str): path of the npz file for scores and selections
+        filename_optim (str): path of the optimizer pickle
+        all_inner_ids (list[int], optional): eval ids of the best inner evaluations, nested search only
+
+    Returns:
+        None
+    """
     score_all_np = np.asarray(all_scores)
-    print('Current Trim Only Best Score: ' + str(np.min(np.sum(score_all_np, axis=1))))
-    print("At index: " + str(str(np.argmin(np.sum(score_all_np, axis=1)))))
+    if conf.nested:
+        # path scores of the best inner evaluations, higher is better
+        print("Current High Score: " + str(np.max(np.sum(score_all_np, axis=1))))
+        print("At index: " + str(str(np.argmax(np.sum(score_all_np, axis=1)))))
+    else:
+        print('Current Trim Only Best Score: ' + str(np.min(np.sum(score_all_np, axis=1))))
+        print("At index: " + str(str(np.argmin(np.sum(score_all_np, axis=1)))))
     # vector_all_np = -1 * np.ones((len(all_vectors), len(max(all_vectors, key = lambda x: len(x)))), dtype=int)
     # for i, j in enumerate(all_vectors):
     #     vector_all_np[i][0:len(j)] = j
@@ -112,7 +156,11 @@ def run_arch_fdm(conf: Namespace, _run=None):
     selection_all_np = np.array(all_individuals).astype(int)
 
     # np.savez_compressed(filename, scores=score_all_np, vectors=vector_all_np, selections=selection_all_np)
-    np.savez_compressed(filename, scores=score_all_np, selections=selection_all_np)
+    if all_inner_ids:
+        np.savez_compressed(filename, scores=score_all_np, selections=selection_all_np,
+                            inner_eval_ids=np.array(all_inner_ids, dtype=int))
+    else:
+        np.savez_compressed(filename, scores=score_all_np, selections=selection_all_np)
     # _run.add_artifact(filename)
     optim.dump(filename_optim)
     # _run.add_artifact(filename_optim)
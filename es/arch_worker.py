@@ -1,17 +1,30 @@
 import ray
+import nevergrad as ng
 import numpy as np
 import os
 import sys
-import shutil
+import time
 
-from prob_design_generator.space import DesignSpace
+from space_cache import load_design_space
 from uav_simulator.simulation import Simulation
 import networkx as nx
 import pickle as pk
-from multiprocessing import Process
-from multiprocessing import Manager
+from scratch import Janitor
+from affinity import pin_worker
+from worker_health import process_usage
+from artifact_store import ArtifactStore
+from sim_process import SimulationChild, SIM_PRELOAD, run_simulation
 from quad_worker import QuadWorker
 from generate_design import Design
+from eval_result import EvalResult
+from design_vector import LQR_KEYS, PATHS
+from trim_scores import score_trims, failure_score, TIMEOUT
+from scheduler import run_with_broker
+
+# components tuned by the inner optimization of the nested search, by container name
+INNER_COMPONENTS = ['Battery', 'ESC', 'Motor', 'Propeller']
+# controls of every path and the LQR bounds in design_space
+INNER_PATHS = {path: 'LQR_' + path[-1] for path in PATHS}
 
 @ray.remote
 class ArchWorker:
@@ -22,51 +35,71 @@ class ArchWorker:
     def __init__(self, conf, worker_id):
         # score keeping
         self.score = []
-        self.eval_done = False
 
         self.conf = conf
         self.worker_id = worker_id
 
-        # trim workers
-        # self.workers = [QuadWorker().remote(conf, i) for i in conf.num_workers]
+        # inner QuadWorkers of the nested search are borrowed from a WorkerBroker, see run_nested
+
+        self.space = load_design_space(self.conf.acel_path, self.conf.design_space_cache)
+
+        # own cores for the worker and its simulation children, meta workers of the nested search only wait on inner workers
+        self.cores, self.core_lock = None, None
+        if self.conf.pin_cores and not self.conf.nested:
+            self.cores, self.core_lock = pin_worker(int(np.ceil(self.conf.cpus_per_eval)))
 
-        self.space = DesignSpace(self.conf.acel_path)
+        # long lived simulation child, null sim_child_max_evals forks a new child per evaluation
+        self.sim_child = None
+        if self.conf.sim_child_max_evals is not None:
+            self.sim_child = SimulationChild(SIM_PRELOAD, self.conf.sim_child_max_evals)
+
+        # eval folders are written to conf.scratch_root if set and cleaned up in the background
+        self.janitor = Janitor(self.conf.scratch_root)
+        # base folder -> ArtifactStore of the design graphs
+        self.stores = {}
 
     def _get_trim_score(self, responses):
         """
         Updates the worker's score when in trim only scenario
 
         Args:
-            responses (dict{pandas.DataFrame}): return from simulation
+            responses (dict{numpy.ndarray}): compact trim tables from simulation, see sim_responses
 
         Returns:
             None
         """
-        # if response is empty, trim is not found
-        if not bool(responses):
-            self.score = 8 * [99999.]
-            return
+        # conf.trim_score selects the score function, see trim_scores
+        self.score = score_trims(self.conf.trim_score, responses)
 
-        # forward trim
-        forward_df = responses['forward']
-        forward_dist_obj = (2000.0 - forward_df['Distance'].max())
-        forward_time_obj = (410.0 - forward_df['Flight time'].max())
-        forward_frac_obj = 500.0 * (forward_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
+    def flush(self):
+        """
+        Waits until the background cleanup of all finished eval folders is done and writes
+        the buffered design graphs of the artifact stores
 
-        # turn radius 500 trim
-        turn_500_df = responses['turn_500']
-        turn_500_dist_obj = (3142.0 - turn_500_df['Distance'].max())
-        turn_500_frac_obj = 500.0 * (turn_500_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
+        Args:
+            None
 
-        # turn radius 300 trim
-        turn_300_df = responses['turn_300']
-        turn_300_dist_obj = (3500.0 - turn_300_df['Distance'].max())
-        turn_300_speed_obj = - turn_300_df['Speed'].max()
-        turn_300_frac_obj = 500.0 * (turn_300_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
+        Returns:
+            None
+        """
+        self.janitor.flush()
+        for store in self.stores.values():
+            store.flush()
+
+    def _save_design_graph(self, design_graph, eval_id, eval_folder, base_folder):
+        # one pickle per eval folder, or the run's artifact store if conf.artifact_store
+        if not self.conf.artifact_store:
+            with open(os.path.join(eval_folder, "design_graph.pk"), "wb") as fout:
+                pk.dump(design_graph, fout)
+            return
+        if base_folder not in self.stores:
+            self.stores[base_folder] = ArtifactStore(os.path.join(base_folder, 'artifacts', self.conf.artifact_run), self.worker_id)
+        self.stores[base_folder].put(eval_id, design_graph)
 
-        self.score = [forward_dist_obj, forward_time_obj, forward_frac_obj, turn_500_dist_obj, turn_500_frac_obj, turn_300_dist_obj, turn_300_speed_obj, turn_300_frac_obj]
-        if np.any(np.isnan(self.score)):
-            self.score = 8 * [99999.]
+    def _report(self, result):
+        # memory and descriptors of the worker, the head recycles workers above conf.max_worker_rss_mb
+        result.info.update(process_usage())
+        return result
 
     def _generate_design(self, base_node, low_selections, high_selections):
         design = Design(self.conf.node_options, self.conf.end_options)
@@ -74,19 +107,114 @@ class ArchWorker:
         design_graph = design.to_design_graph(self.space)
         return design_graph
 
+    def _inner_param(self, design_graph):
+        """
+        Parametrization of the inner optimization of a topology, one variant choice per
+        battery, ESC, motor and propeller node and the controls of every path
+
+        Args:
+            design_graph (networkx.DiGraph): topology with default components
+
+        Returns:
+            param (nevergrad.p.Dict): inner parametrization
+        """
+        param = ng.p.Dict()
+        for name in design_graph.nodes:
+            container_name = design_graph.nodes[name]['instance']
+            if container_name in INNER_COMPONENTS:
+                num_variants = len(self.space.find(container_name).variants)
+                param[name] = ng.p.Choice(np.arange(num_variants))
+        for path, lqr in INNER_PATHS.items():
+            param[path] = ng.p.Array(shape=(len(LQR_KEYS), ), lower=self.conf.design_space[lqr][1], upper=self.conf.design_space[lqr][2])
+        param['lat_vel'] = ng.p.Array(shape=(len(INNER_PATHS), ), lower=self.conf.design_space['lateral_velocity'][1], upper=self.conf.design_space['lateral_velocity'][2])
+        param['vert_vel'] = ng.p.Array(shape=(len(INNER_PATHS), ), lower=self.conf.design_space['vertical_velocity'][1], upper=self.conf.design_space['vertical_velocity'][2])
+        return param
+
+    def _apply_inner(self, design_graph, value):
+        """
+        Copy of a topology with the components and controls of an inner candidate
+
+        Args:
+            design_graph (networkx.DiGraph): topology with default components
+            value (dict): value of an inner candidate, see _inner_param
+
+        Returns:
+            design_graph (networkx.DiGraph): design graph to simulate
+        """
+        # node attribute dicts and controls are copied, unchanged components are shared
+        graph = design_graph.copy()
+        for name in graph.nodes:
+            if name in value:
+                container = self.space.find(graph.nodes[name]['instance'])
+                graph.nodes[name]['node'] = container.instantiate_variant(container.variants[int(value[name])])
+        for i, path in enumerate(INNER_PATHS):
+            controls = dict(zip(LQR_KEYS, [float(x) for x in value[path]]))
+            controls['latvel'] = float(value['lat_vel'][i])
+            controls['vertvel'] = float(value['vert_vel'][i])
+            graph.graph[path] = controls
+        return graph
+
+    def run_nested(self, work, eid, broker):
+        """
+        Scores a topology with an inner optimization of its components and controls on
+        QuadWorkers borrowed from broker, at most conf.num_workers at once
+
+        Args:
+            work (dict): current candidate
+            eid (int): id of the evaluation, also the client id at the broker
+            broker (ray.actor.ActorHandle): WorkerBroker of the inner QuadWorkers
+
+        Returns:
+            result (EvalResult): path scores of the best inner candidate, its eval id in info
+        """
+        start = time.time()
+        design_graph = self._generate_design(work['base_node'],
+                                             list(work['low_selections']),
+                                             list(work['high_selections']))
+        optim = ng.optimizers.registry[self.conf.inner_optim_method](parametrization=self._inner_param(design_graph),
+                                                                     budget=self.conf.inner_budget,
+                                                                     num_workers=self.conf.num_workers)
+        optim.parametrization.random_state = np.random.RandomState(self.conf.seed + eid)
+
+        # inner eval ids of every topology are disjoint
+        inner_ids = iter(range(eid * self.conf.inner_budget, (eid + 1) * self.conf.inner_budget))
+        base_folder = os.path.join(self.conf.base_folder, 'nested')
+        best = {'loss': np.inf, 'score': [0.0, 0.0, 0.0, 0.0], 'eval_id': None}
+
+        def ask():
+            return next(inner_ids), optim.ask()
+
+        def submit(worker, cand):
+            inner_id, ind = cand
+            return worker.run_graph.remote(self._apply_inner(design_graph, ind.value), inner_id, 'all', base_folder)
+
+        def tell(cand, result):
+            inner_id, ind = cand
+            # negate since we want to maximize scores
+            loss = 1600.0 - np.sum(result.score)
+            optim.tell(ind, loss)
+            if loss < best['loss']:
+                best.update(loss=loss, score=result.score, eval_id=inner_id)
+
+        run_with_broker(broker, eid, ask, submit, tell, self.conf.inner_budget, self.conf.num_workers)
+        return self._report(EvalResult(eid, self.worker_id, best['score'], 'ok', time.time() - start,
+                                       info={'best_inner_eval_id': best['eval_id']}))
+
     def run_sim(self, work, eid):
         """
         Runs the full SwRI simulation with LQR parameters
 
         Args:
             work (dict): current candidate
+            eid (int): id of the evaluation
 
         Returns:
-            None
+            result (EvalResult): score vector and status of the evaluation
         """
         # reset score before sim
         self.score = []
-        self.eval_done = False
+        status = 'ok'
+        start = time.time()
 
         design_graph = self._generate_design(work['base_node'],
                                              list(work['low_selections']),
@@ -94,38 +222,28 @@ class ArchWorker:
 
         try:
             simulation = Simulation(eval_id=eid,
-                                    base_folder=self.conf.base_folder,
+                                    base_folder=self.janitor.eval_root(self.conf.base_folder),
                                     create_folder=True)
-            manager = Manager()
-            responses = manager.dict()
             # run trim only
-            process = Process(target=simulation.evaluate_design,
-                              args=(design_graph, True, True, [], True, False, responses))
-            process.start()
-            process.join()
-
-            self._get_trim_score(responses)
+            finished, responses = run_simulation(simulation, (design_graph, True, True, [], True, False),
+                                                 self.conf.eval_timeout, self.sim_child)
+
+            if not finished:
+                # hung simulation, killed with its process tree
+                status = 'timeout'
+                self.score = failure_score(self.conf.trim_score, TIMEOUT)
+            else:
+                if not bool(responses):
+                    status = 'no_trim'
+                self._get_trim_score(responses)
             
-            output_path = os.path.join(simulation.eval_folder, "design_graph.pk")
-            with open(output_path, "wb") as fout:
-                pk.dump(design_graph, fout)
+            self._save_design_graph(design_graph, eid, simulation.eval_folder, self.conf.base_folder)
 
-            shutil.rmtree(os.path.join(simulation.eval_folder, "assembly/"))
+            # a killed simulation may not have written its assembly yet, the janitor ignores missing folders
+            self.janitor.finish(simulation.eval_folder, self.conf.base_folder)
         except Exception as e:
             # print(e)
-            self.score = 8 * [99999.]
-
-        self.eval_done = True
+            status = 'error'
+            self.score = failure_score(self.conf.trim_score)
 
-    def collect(self):
-        """
-        Collect function, called when lap time is requested
-        Resets worker instance after called
-        Args:
-            None
-        Returns:
-            curr_laptime (float): score/laptime of the current rollout
-        """
-        while not self.eval_done:
-            continue
-        return self.score
+        return self._report(EvalResult(eid, self.worker_id, self.score, status, time.time() - start))
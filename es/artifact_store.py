@@ -0,0 +1,173 @@
+import os
+import glob
+import zlib
+import hashlib
+import pickle as pk
+
+
+class ArtifactStore:
+    """
+    Append-only, content addressed store of the design graphs of one worker
+
+    Every unique graph is pickled, compressed and appended once to the pack file of the
+    worker, the index file maps every eval id to the hash and location of its graph.
+    Writes are buffered and appended in batches of flush_every evaluations, pack data is
+    always written before the index lines that point to it.
+
+    Files under root, per worker:
+        pack_<worker_id>.bin: concatenated zlib compressed pickles
+        index_<worker_id>.tsv: lines of eval_id, sha1 of the pickle, offset and length in the pack
+
+    Eval ids are only unique within a run, every run gets its own root, see run_name.
+    """
+    def __init__(self, root, worker_id, flush_every=50):
+        self.root = root
+        self.flush_every = flush_every
+        self.pack_path = os.path.join(root, 'pack_' + str(worker_id) + '.bin')
+        self.index_path = os.path.join(root, 'index_' + str(worker_id) + '.tsv')
+        if not os.path.exists(root):
+            os.makedirs(root, exist_ok=True)
+
+        # hash -> (offset, length) of the graphs already in the pack, from a previous run of the worker too
+        self.locations = {}
+        for _, digest, offset, length in _read_index(self.index_path):
+            self.locations[digest] = (offset, length)
+        self.pack_size = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+
+        self.pack_buffer = []
+        self.index_buffer = []
+
+    def put(self, eval_id, design_graph):
+        """
+        Stores the design graph of an evaluation, identical graphs are stored once
+
+        Args:
+            eval_id (int): id of the evaluation
+            design_graph (networkx.DiGraph): design graph of the evaluation
+
+        Returns:
+            digest (str): sha1 of the pickled graph
+        """
+        data = pk.dumps(design_graph, protocol=pk.HIGHEST_PROTOCOL)
+        digest = hashlib.sha1(data).hexdigest()
+        if digest not in self.locations:
+            blob = zlib.compress(data)
+            self.locations[digest] = (self.pack_size, len(blob))
+            self.pack_size += len(blob)
+            self.pack_buffer.append(blob)
+        offset, length = self.locations[digest]
+        self.index_buffer.append('\t'.join([str(eval_id), digest, str(offset), str(length)]) + '\n')
+        if len(self.index_buffer) >= self.flush_every:
+            self.flush()
+        return digest
+
+    def flush(self):
+        """
+        Appends the buffered graphs and index lines to the files
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self.pack_buffer:
+            with open(self.pack_path, 'ab') as fout:
+                fout.write(b''.join(self.pack_buffer))
+            self.pack_buffer = []
+        if self.index_buffer:
+            with open(self.index_path, 'a') as fout:
+                fout.write(''.join(self.index_buffer))
+            self.index_buffer = []
+
+
+def run_name(filenames):
+    """
+    Name of the folder of the artifact stores of a run under base_folder/artifacts, set as
+    conf.artifact_run by the heads before starting the workers of the run
+
+    Args:
+        filenames (list[str]): paths of the npz result files of the optimizers sharing the workers
+
+    Returns:
+        name (str): file names without extension, joined by '+'
+    """
+    return '+'.join([os.path.basename(filename)[:-len('.npz')] for filename in filenames])
+
+
+def _read_index(index_path):
+    if not os.path.exists(index_path):
+        return []
+    entries = []
+    with open(index_path) as fin:
+        for line in fin:
+            fields = line.split()
+            # a run killed mid write may leave a partial last line
+            if len(fields) == 4:
+                entries.append((int(fields[0]), fields[1], int(fields[2]), int(fields[3])))
+    return entries
+
+
+class ArtifactIndex:
+    """
+    Read side of the artifact stores of all workers of a run, e.g. for analysis scripts
+
+    Usage:
+        index = ArtifactIndex('evals/artifacts/' + run_name(['iccps_runs/npzs/quad_CMA_budget1000.npz']))
+        design_graph = index.load(eval_id)
+    """
+    def __init__(self, root):
+        self.root = root
+        # eval id -> (pack path, hash, offset, length)
+        self.entries = {}
+        duplicates = set()
+        for index_path in sorted(glob.glob(os.path.join(root, 'index_*.tsv'))):
+            pack_path = os.path.join(root, 'pack_' + os.path.basename(index_path)[len('index_'):-len('.tsv')] + '.bin')
+            for eval_id, digest, offset, length in _read_index(index_path):
+                if eval_id in self.entries and self.entries[eval_id][1] != digest:
+                    duplicates.add(eval_id)
+                self.entries[eval_id] = (pack_path, digest, offset, length)
+        # e.g. evaluations asked after the last checkpoint of a resumed run, their ids are given out again
+        for eval_id in duplicates:
+            del self.entries[eval_id]
+        if duplicates:
+            print(str(len(duplicates)) + ' eval ids with different design graphs in ' + root + ' are skipped')
+
+    def eval_ids(self):
+        """
+        Ids of all stored evaluations
+
+        Args:
+            None
+
+        Returns:
+            eval_ids (list[int]): sorted eval ids
+        """
+        return sorted(self.entries.keys())
+
+    def digest(self, eval_id):
+        """
+        Hash of the design graph of an evaluation, equal hashes mean identical graphs
+
+        Args:
+            eval_id (int): id of the evaluation
+
+        Returns:
+            digest (str): sha1 of the pickled graph
+        """
+        return self.entries[eval_id][1]
+
+    def load(self, eval_id):
+        """
+        Loads the design graph of an evaluation
+
+        Args:
+            eval_id (int): id of the evaluation
+
+        Returns:
+            design_graph (networkx.DiGraph): stored design graph
+        """
+        pack_path, _, offset, length = self.entries[eval_id]
+        with open(pack_path, 'rb') as fin:
+            fin.seek(offset)
+            return pk.loads(zlib.decompress(fin.read(length)))
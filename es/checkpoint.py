@@ -0,0 +1,116 @@
+import os
+import json
+import pickle as pk
+
+
+def save_checkpoint(path, state):
+    """
+    Atomically writes a checkpoint, a crash while writing leaves the previous checkpoint intact
+
+    Args:
+        path (str): path of the checkpoint pickle
+        state (dict): checkpoint state, objects referenced more than once (e.g. the optimizer
+                      and its in-flight candidates) stay shared after loading
+
+    Returns:
+        None
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fout:
+        pk.dump(state, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Loads a checkpoint written by save_checkpoint
+
+    Args:
+        path (str): path of the checkpoint pickle
+
+    Returns:
+        state (dict): checkpoint state, None if there is no checkpoint at path
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fin:
+        return pk.load(fin)
+
+
+class EvalLog:
+    """
+    Append-only log of finished evaluations, one json line per evaluation
+
+    Every line is flushed to disk when written so that results of evaluations that
+    finished after the last checkpoint survive a crash of the head.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fout = open(path, 'a')
+
+    def append(self, eval_id, score, status, vector):
+        """
+        Appends a finished evaluation to the log
+
+        Args:
+            eval_id (int): id of the evaluation
+            score (list[float]): score vector of the evaluation
+            status (str): status of the evaluation
+            vector (list): flat design vector of the evaluation
+
+        Returns:
+            None
+        """
+        entry = {'eval_id': int(eval_id),
+                 'score': [float(x) for x in score],
+                 'status': status,
+                 'vector': [float(x) for x in vector]}
+        self.fout.write(json.dumps(entry) + '\n')
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+
+    def read(self):
+        """
+        Reads all complete entries of the log
+
+        Args:
+            None
+
+        Returns:
+            entries (dict{int: dict}): log entries by eval id
+        """
+        entries = {}
+        with open(self.path, 'r') as fin:
+            for line in fin:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # last line may be cut by the crash
+                    continue
+                entries[entry['eval_id']] = entry
+        return entries
+
+    def truncate(self, next_eval_id):
+        """
+        Drops entries of evaluations asked after a checkpoint, their eval ids are given out again on resume
+
+        Args:
+            next_eval_id (int): first eval id not covered by the checkpoint
+
+        Returns:
+            entries (dict{int: dict}): remaining log entries by eval id
+        """
+        entries = {eval_id: entry for eval_id, entry in self.read().items() if eval_id < next_eval_id}
+        self.fout.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fout:
+            for eval_id in sorted(entries):
+                fout.write(json.dumps(entries[eval_id]) + '\n')
+        os.replace(tmp_path, self.path)
+        self.fout = open(self.path, 'a')
+        return entries
+
+    def close(self):
+        self.fout.close()
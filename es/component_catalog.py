@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from space_cache import load_design_space
+
+# air density at sea level, kg/m^3
+RHO = 1.225
+G = 9.81
+
+
+def _read_property(instance, name):
+    try:
+        return float(getattr(instance, name).default)
+    except (AttributeError, TypeError, ValueError):
+        return np.nan
+
+
+def compile_catalog(acel_path, properties, space=None):
+    """
+    Reads the properties of every component variant in the design space into arrays,
+    choice i of a slot is variant i of its container
+
+    Args:
+        acel_path (str): path to design space file
+        properties (dict): per slot type (e.g. 'battery'), the container name under 'container'
+                           and the acel property name of every catalog column
+        space (prob_design_generator.space.DesignSpace, optional): already loaded design space of acel_path
+
+    Returns:
+        catalog (dict{str: dict{str: numpy.ndarray}}): per slot type, one float array per column, nan where missing
+    """
+    if space is None:
+        space = load_design_space(acel_path)
+    catalog = {}
+    for slot, columns in properties.items():
+        container = space.find(columns['container'])
+        instances = [container.instantiate_variant(variant) for variant in container.variants]
+        catalog[slot] = {column: np.array([_read_property(instance, name) for instance in instances])
+                         for column, name in columns.items() if column != 'container'}
+    return catalog
+
+
+def load_catalog(conf, cache_dir='iccps_runs/catalogs'):
+    """
+    Loads the component catalog of conf.acel_path, compiled once and cached as npz
+    until the design space file or conf.catalog_properties change
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        cache_dir (str): directory of the compiled catalogs
+
+    Returns:
+        catalog (dict{str: dict{str: numpy.ndarray}}): see compile_catalog
+    """
+    stat = os.stat(conf.acel_path)
+    digest = hashlib.sha1(json.dumps([os.path.abspath(conf.acel_path), stat.st_mtime, stat.st_size,
+                                      conf.catalog_properties], sort_keys=True).encode()).hexdigest()
+    path = os.path.join(cache_dir, 'catalog_' + digest + '.npz')
+    if os.path.exists(path):
+        data = np.load(path)
+        catalog = {}
+        for key in data.files:
+            slot, column = key.split('/')
+            catalog.setdefault(slot, {})[column] = data[key]
+        return catalog
+
+    catalog = compile_catalog(conf.acel_path, conf.catalog_properties, load_design_space(conf.acel_path, conf.design_space_cache))
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    np.savez(path, **{slot + '/' + column: values for slot, columns in catalog.items() for column, values in columns.items()})
+    return catalog
+
+
+class PhysicsCheck:
+    """
+    Vectorized static feasibility check of component choices against the catalog
+
+    Checks, enabled with the 'physics_checks' key in the config:
+        esc_current: every ESC carries the max current of the motor on its arm
+        esc_voltage: every ESC takes the battery voltage
+        battery_current: the battery discharge limit covers the max current of all motors
+        thrust_to_weight: the ideal static thrust of all props at max motor power, an upper bound
+                          from momentum theory, lifts min_thrust_to_weight times the total mass
+    Checks on columns missing from the catalog (nan) pass.
+
+    Registered as a cheap constraint on the parametrization, so that optimizers resample
+    violating candidates without spending budget on them.
+    """
+    def __init__(self, catalog, checks, frame_mass=0.0, min_thrust_to_weight=1.0):
+        self.catalog = catalog
+        self.checks = checks
+        self.frame_mass = frame_mass
+        self.min_thrust_to_weight = min_thrust_to_weight
+
+    def _column(self, slot, column, choices):
+        values = self.catalog.get(slot, {}).get(column)
+        if values is None:
+            return np.full(choices.shape, np.nan)
+        return values[choices]
+
+    def violations(self, selections):
+        """
+        Checks a batch of designs
+
+        Args:
+            selections (dict{str: numpy.ndarray (N, K)}): per slot type, choice indices of its K slots in N designs
+
+        Returns:
+            violated (numpy.ndarray (N, ), bool): True for designs that break a hard bound
+        """
+        battery, esc = selections['battery'], selections['esc']
+        motor, prop = selections['motor'], selections['prop']
+        num_arms = min(esc.shape[1], motor.shape[1], prop.shape[1])
+        esc, motor, prop = esc[:, :num_arms], motor[:, :num_arms], prop[:, :num_arms]
+        violated = np.zeros(len(battery), dtype=bool)
+
+        # comparisons with nan are False, missing data never rejects
+        motor_current = self._column('motor', 'max_current', motor)
+        if 'esc_current' in self.checks:
+            violated |= np.any(self._column('esc', 'max_current', esc) < motor_current, axis=1)
+
+        voltage = np.min(self._column('battery', 'voltage', battery), axis=1)
+        if 'esc_voltage' in self.checks:
+            violated |= np.any(self._column('esc', 'max_voltage', esc) < voltage[:, None], axis=1)
+
+        if 'battery_current' in self.checks:
+            # capacity in mAh times C rating
+            discharge = np.sum(self._column('battery', 'capacity', battery) / 1000.0
+                               * self._column('battery', 'discharge_rate', battery), axis=1)
+            violated |= discharge < np.sum(motor_current, axis=1)
+
+        if 'thrust_to_weight' in self.checks:
+            # masses in g, diameters in mm
+            mass = (self.frame_mass + np.sum(self._column('battery', 'mass', battery), axis=1)
+                    + np.sum(self._column('esc', 'mass', esc) + self._column('motor', 'mass', motor)
+                             + self._column('prop', 'mass', prop), axis=1)) / 1000.0
+            area = np.pi * (self._column('prop', 'diameter', prop) / 2000.0) ** 2
+            thrust = np.sum(np.cbrt(self._column('motor', 'max_power', motor) ** 2 * 2.0 * RHO * area), axis=1)
+            violated |= thrust < self.min_thrust_to_weight * mass * G
+        return violated
+
+    def __call__(self, value):
+        """
+        Cheap constraint of a candidate value, see nevergrad register_cheap_constraint
+
+        Args:
+            value (dict): candidate value with slots battery0, esc0.., motor0.., prop0..
+
+        Returns:
+            satisfied (bool): False if the candidate breaks a hard bound
+        """
+        selections = {slot: np.array([[value[slot + str(i)] for i in range(_num_slots(value, slot))]], dtype=int)
+                      for slot in ['battery', 'esc', 'motor', 'prop']}
+        return not self.violations(selections)[0]
+
+    def rejected_fraction(self, design_space, num_samples=10000, seed=None):
+        """
+        Fraction of uniformly random designs rejected by the check
+
+        Args:
+            design_space (dict): design_space from the config
+            num_samples (int): number of random designs
+            seed (int, optional): seed of the samples
+
+        Returns:
+            fraction (float): estimated fraction of the discrete space rejected
+        """
+        rng = np.random.RandomState(seed)
+        selections = {slot: rng.randint(design_space[slot][1], size=(num_samples, design_space[slot][0]))
+                      for slot in ['battery', 'esc', 'motor', 'prop']}
+        return float(np.mean(self.violations(selections)))
+
+
+def _num_slots(value, slot):
+    num = 0
+    while slot + str(num) in value:
+        num += 1
+    return num
@@ -0,0 +1,212 @@
+import numpy as np
+
+
+def flatten_work(raw_work):
+    """
+    Flattens a candidate work dict into the selected vector used to construct the design
+
+    Args:
+        raw_work (dict): sampled current candidate
+
+    Returns:
+        selected_vector (list): flat design vector, eval_id is skipped
+    """
+    selected_vector = []
+    for key in raw_work:
+        if isinstance(raw_work[key], np.ndarray):
+            selected_vector.extend(list(raw_work[key]))
+        elif key == 'eval_id':
+            continue
+        # elif key == 'discrete_baseline':
+        #     selected_vector = [*(raw_work[key]), *selected_vector]
+        elif key == 'trim_discrete_baseline':
+            selected_vector.extend(raw_work[key])
+        elif key == 'lat_vel' or key == 'vert_vel':
+            selected_vector.extend(raw_work[key])
+        else:
+            selected_vector.append(raw_work[key])
+    return selected_vector
+
+
+class FlatPlan:
+    """
+    Flattening plan compiled once from a parametrization value, maps work dicts to flat float64
+    vectors and back with fixed offsets, so batches of candidates need no per-entry type checks
+
+    Arrays and lists are spread over one slot per element, scalars take one slot, entries are
+    in the order of the template and keys missing from it (eval_id) are skipped. The vectors
+    match the ones written by flatten_work and stored in the result npz files.
+
+    Usage:
+        plan = FlatPlan(optim.parametrization.value)
+        vectors = plan.flatten_batch([ind.args[0] for ind in inds])
+        value = plan.unflatten(vectors[0])
+    """
+    def __init__(self, template):
+        # key -> (offset, size, kind, shape, dtype), kind is one of 'array', 'list', 'int', 'float'
+        self.entries = {}
+        self.slot_names = []
+        offset = 0
+        for key, value in template.items():
+            if key == 'eval_id':
+                continue
+            if isinstance(value, np.ndarray):
+                entry = (offset, value.size, 'array', value.shape, value.dtype)
+            elif isinstance(value, (list, tuple)):
+                entry = (offset, len(value), 'list', (len(value), ), [type(x) for x in value])
+            elif isinstance(value, (int, np.integer)):
+                entry = (offset, 1, 'int', (), int)
+            else:
+                entry = (offset, 1, 'float', (), float)
+            self.entries[key] = entry
+            if entry[2] in ['array', 'list']:
+                self.slot_names.extend(key + '[' + str(i) + ']' for i in range(entry[1]))
+            else:
+                self.slot_names.append(key)
+            offset += entry[1]
+        self.size = offset
+
+    def schema(self):
+        """
+        Names of the slots of the flat vectors, stored next to the vectors in the result files
+
+        Args:
+            None
+
+        Returns:
+            slots (numpy.ndarray (size, )): name of every slot, key[i] for elements of arrays and lists
+        """
+        return np.asarray(self.slot_names)
+
+    def slots(self, keys):
+        """
+        Positions of the slots of some keys in the flat vectors
+
+        Args:
+            keys (list[str]): keys of the template
+
+        Returns:
+            indices (numpy.ndarray (K, )): slot indices of the keys, in the order of the template
+        """
+        indices = [np.arange(offset, offset + size) for key, (offset, size, _, _, _) in self.entries.items() if key in keys]
+        if not indices:
+            return np.zeros(0, dtype=int)
+        return np.concatenate(indices)
+
+    def flatten(self, work):
+        """
+        Flattens one work dict
+
+        Args:
+            work (dict): candidate with every key of the template
+
+        Returns:
+            vector (numpy.ndarray (size, )): flat float64 vector
+        """
+        return self.flatten_batch([work])[0]
+
+    def flatten_batch(self, works):
+        """
+        Flattens a batch of work dicts into one preallocated array, filled one key at a time
+
+        Args:
+            works (list[dict]): candidates with every key of the template
+
+        Returns:
+            vectors (numpy.ndarray (N, size)): flat float64 vectors, one row per candidate
+        """
+        vectors = np.empty((len(works), self.size), dtype=np.float64)
+        if not works:
+            return vectors
+        for key, (offset, size, kind, _, _) in self.entries.items():
+            if kind in ['array', 'list']:
+                vectors[:, offset:offset + size] = np.asarray([work[key] for work in works], dtype=np.float64).reshape(len(works), size)
+            else:
+                vectors[:, offset] = [work[key] for work in works]
+        return vectors
+
+    def unflatten(self, vector):
+        """
+        Maps a flat vector back onto a work dict with the types of the template
+
+        Args:
+            vector (numpy.ndarray (size, )): flat vector, entries in the order of the template
+
+        Returns:
+            work (dict): value for the parametrization built from vector
+        """
+        if len(vector) != self.size:
+            raise ValueError('Vector of size ' + str(len(vector)) + ' does not match parametrization of size ' + str(self.size))
+        vector = np.asarray(vector, dtype=np.float64)
+        work = {}
+        for key, (offset, size, kind, shape, dtype) in self.entries.items():
+            if kind == 'array':
+                work[key] = vector[offset:offset + size].astype(dtype).reshape(shape)
+            elif kind == 'list':
+                work[key] = [cast(v) for cast, v in zip(dtype, vector[offset:offset + size].tolist())]
+            elif kind == 'int':
+                work[key] = int(round(vector[offset]))
+            else:
+                work[key] = float(vector[offset])
+        return work
+
+    def unflatten_batch(self, vectors):
+        """
+        Maps the rows of an array of flat vectors back onto work dicts
+
+        Args:
+            vectors (numpy.ndarray (N, size)): flat vectors, one row per candidate
+
+        Returns:
+            works (list[dict]): one work dict per row
+        """
+        return [self.unflatten(vector) for vector in np.asarray(vectors, dtype=np.float64)]
+
+
+# control entries of a work dict, per path LQR weights and velocities, see work_controls
+CONTROL_KEYS = ['lqr_vector1', 'lqr_vector3', 'lqr_vector4', 'lqr_vector5', 'lat_vel', 'vert_vel']
+PATHS = ['path1', 'path3', 'path4', 'path5']
+LQR_KEYS = ['Q_position', 'Q_velocity', 'Q_Angular_velocity', 'Q_angles', 'R']
+
+
+def structure_key(raw_work):
+    """
+    Hashable key of the structural part of a candidate, components and lengths, so that
+    candidates that only differ in their controls share a key
+
+    Args:
+        raw_work (dict): sampled current candidate
+
+    Returns:
+        key (tuple): key of every non control entry, None if raw_work has no complete set of controls
+    """
+    if any(key not in raw_work for key in CONTROL_KEYS):
+        return None
+    key = []
+    for name in raw_work:
+        if name in CONTROL_KEYS or name == 'eval_id':
+            continue
+        value = raw_work[name]
+        if isinstance(value, (np.ndarray, list, tuple)):
+            key.append((name, tuple(np.asarray(value).ravel().tolist())))
+        else:
+            key.append((name, value))
+    return tuple(key)
+
+
+def work_controls(raw_work):
+    """
+    Controls of the design graph, graph.graph entries of every path, from a candidate
+
+    Args:
+        raw_work (dict): sampled current candidate with all CONTROL_KEYS
+
+    Returns:
+        controls (dict{str: dict}): LQR weights, latvel and vertvel of every path
+    """
+    controls = {}
+    for i, path in enumerate(PATHS):
+        controls[path] = dict(zip(LQR_KEYS, [float(x) for x in raw_work['lqr_vector' + path[-1]]]))
+        controls[path]['latvel'] = float(raw_work['lat_vel'][i])
+        controls[path]['vertvel'] = float(raw_work['vert_vel'][i])
+    return controls
@@ -0,0 +1,81 @@
+import sqlite3
+import hashlib
+import json
+import numpy as np
+
+
+class EvalCache:
+    """
+    Disk-backed cache of evaluation scores, keyed by the canonical design vector,
+    the score type, the vehicle and what else the score depends on
+
+    Backed by a single SQLite file so that it survives across runs and seeds.
+    Heads and workers on different nodes can share it through a shared filesystem,
+    concurrent writers are serialized by SQLite's file lock.
+    """
+    def __init__(self, path, timeout=60.0):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS evals (key TEXT PRIMARY KEY, score TEXT, status TEXT)')
+        self.num_hits = 0
+        self.num_misses = 0
+
+    @staticmethod
+    def make_key(vector, score_type, vehicle, context=None):
+        """
+        Content address of an evaluation
+
+        Args:
+            vector (list): flat design vector, see design_vector.flatten_work
+            score_type (str): one of ['trim', 'all']
+            vehicle (str): vehicle type
+            context (list[str], optional): other inputs of the score, e.g. the trim score function
+                                           and the design space, see space_cache.space_id
+
+        Returns:
+            key (str): hex digest identifying the evaluation
+        """
+        # canonical form, ints and floats of the same value hash the same
+        canonical = np.round(np.asarray(vector, dtype=np.float64), 9) + 0.0
+        digest = hashlib.sha1()
+        digest.update((score_type + '/' + vehicle + '/').encode())
+        for part in (context if context is not None else []):
+            digest.update((part + '/').encode())
+        digest.update(canonical.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Looks up a cached evaluation
+
+        Args:
+            key (str): key from make_key
+
+        Returns:
+            score (list[float]): cached score vector, None if not cached
+            status (str): status of the cached evaluation, None if not cached
+        """
+        row = self.conn.execute('SELECT score, status FROM evals WHERE key = ?', (key, )).fetchone()
+        if row is None:
+            self.num_misses += 1
+            return None, None
+        self.num_hits += 1
+        return json.loads(row[0]), row[1]
+
+    def put(self, key, score, status):
+        """
+        Stores an evaluation, existing entries are kept
+
+        Args:
+            key (str): key from make_key
+            score (list[float]): score vector of the evaluation
+            status (str): status of the evaluation
+
+        Returns:
+            None
+        """
+        self.conn.execute('INSERT OR IGNORE INTO evals (key, score, status) VALUES (?, ?, ?)',
+                          (key, json.dumps([float(x) for x in score]), status))
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,24 @@
+class EvalResult:
+    """
+    Result record of a single evaluation, returned by the workers' run_sim
+
+    Attributes:
+        eval_id (int): id of the evaluation
+        worker_id (int): id of the worker that ran the evaluation
+        score (list[float]): score vector of the evaluation
+        status (str): one of ['ok', 'no_trim', 'error', 'timeout']
+        wall_time (float): wall clock time of the evaluation in seconds
+        info (dict): extra data of the evaluation, e.g. the best inner evaluation of a nested arch evaluation
+                     or the memory use of the worker, see worker_health.process_usage, 'cached' is True
+                     for results found in an evaluation cache instead of simulated
+    """
+    def __init__(self, eval_id, worker_id, score, status='ok', wall_time=0.0, info=None):
+        self.eval_id = eval_id
+        self.worker_id = worker_id
+        self.score = score
+        self.status = status
+        self.wall_time = wall_time
+        self.info = info if info is not None else {}
+
+    def __repr__(self):
+        return 'EvalResult(eval_id={}, worker_id={}, status={}, score={})'.format(self.eval_id, self.worker_id, self.status, self.score)
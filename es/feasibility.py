@@ -0,0 +1,192 @@
+import numpy as np
+
+from trim_scores import NO_TRIM
+
+
+def score_status(score):
+    """
+    Status of a stored evaluation whose status was not kept, e.g. warm start and resumed scores
+
+    Args:
+        score (list[float]): score vector of the evaluation
+
+    Returns:
+        status (str): 'no_trim' if every entry is the no trim score, 'ok' otherwise
+    """
+    # saturated fractions alone can push single entries past the no trim score, it fills all of them
+    return 'no_trim' if np.all(np.asarray(score) == NO_TRIM) else 'ok'
+
+
+def discrete_slots(work, design_space):
+    """
+    Component choices of a candidate, e.g. battery0, esc0..esc3, prop0..prop3, motor0..motor3
+
+    Args:
+        work (dict): candidate work dict
+        design_space (dict): design_space from the config, number of choices of every component
+
+    Returns:
+        slots (list[tuple(str, int)]): name and choice index of every discrete slot, in work order
+    """
+    slots = []
+    for key, value in work.items():
+        name = key.rstrip('0123456789')
+        if name in design_space and isinstance(value, (int, np.integer)):
+            slots.append((key, int(value)))
+    return slots
+
+
+class FeasibilityFilter:
+    """
+    Rejects candidates of the trim phase that almost surely find no trim, before they are simulated
+
+    Two checks on the discrete component slots:
+        negative cache: exact component combinations that already failed trim
+        classifier: logistic regression on one-hot encoded slots, trained online on all
+                    evaluations, rejects when the probability of finding a trim is below threshold
+
+    A fraction audit of the classifier rejections is simulated anyway to measure its precision.
+    """
+    def __init__(self, design_space, threshold=0.05, min_samples=100, retrain_every=20, audit=0.05, seed=None):
+        self.design_space = design_space
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.retrain_every = retrain_every
+        self.audit_rate = audit
+        self.rng = np.random.RandomState(seed)
+
+        self.negative = set()
+        # one-hot offset of every slot, set from the first candidate
+        self.keys = None
+        self.offsets = None
+        self.weights = None
+        self.bias = 0.0
+        self.features = []
+        self.labels = []
+        self.num_fitted = 0
+
+        self.num_checked = 0
+        self.num_rejected_cache = 0
+        self.num_rejected_classifier = 0
+        self.num_audited = 0
+        self.num_audited_infeasible = 0
+
+    def _encode(self, work):
+        slots = discrete_slots(work, self.design_space)
+        if self.keys is None:
+            self.keys = [key for key, _ in slots]
+            sizes = [self.design_space[key.rstrip('0123456789')][1] for key in self.keys]
+            self.offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(int)
+            self.weights = np.zeros(int(np.sum(sizes)))
+        values = np.array([value for _, value in slots], dtype=int)
+        return tuple(values), self.offsets + values
+
+    def _fit(self, iterations=100, step=0.5, l2=1e-3):
+        # full batch gradient descent, warm started from the previous weights
+        features = np.asarray(self.features)
+        labels = np.asarray(self.labels, dtype=np.float64)
+        num_slots = features.shape[1]
+        for _ in range(iterations):
+            prob = 1.0 / (1.0 + np.exp(-(self.bias + self.weights[features].sum(axis=1))))
+            err = (prob - labels) / len(labels)
+            grad = l2 * self.weights
+            np.add.at(grad, features.ravel(), np.repeat(err, num_slots))
+            self.weights -= step * grad
+            self.bias -= step * np.sum(err)
+        self.num_fitted = len(labels)
+
+    def feasible_prob(self, work):
+        """
+        Probability that a candidate finds a trim
+
+        Args:
+            work (dict): candidate work dict
+
+        Returns:
+            prob (float): predicted probability, None before the classifier is trained
+        """
+        if self.num_fitted == 0:
+            return None
+        _, features = self._encode(work)
+        return 1.0 / (1.0 + np.exp(-(self.bias + np.sum(self.weights[features]))))
+
+    def add(self, work, score, status):
+        """
+        Adds a simulated candidate to the negative cache and the classifier training data
+
+        Args:
+            work (dict): candidate work dict
+            score (list[float]): score vector of the evaluation
+            status (str): status of the evaluation, errors and timeouts may be transient and are skipped,
+                          'no_trim' labels the candidate infeasible
+
+        Returns:
+            None
+        """
+        if status in ['error', 'timeout']:
+            return
+        combination, features = self._encode(work)
+        feasible = status != 'no_trim'
+        if not feasible:
+            self.negative.add(combination)
+        self.features.append(features)
+        self.labels.append(feasible)
+        if len(self.labels) >= self.min_samples and len(self.labels) - self.num_fitted >= self.retrain_every:
+            self._fit()
+
+    def check(self, work):
+        """
+        Checks a candidate before dispatch
+
+        Args:
+            work (dict): candidate work dict
+
+        Returns:
+            reason (str): 'cache' or 'classifier' if the candidate is rejected, 'audit' for a classifier
+                          rejection to simulate anyway and pass to record_audit, None if it has to be simulated
+        """
+        self.num_checked += 1
+        combination, _ = self._encode(work)
+        if combination in self.negative:
+            self.num_rejected_cache += 1
+            return 'cache'
+        prob = self.feasible_prob(work)
+        if prob is not None and prob < self.threshold:
+            if self.rng.rand() < self.audit_rate:
+                return 'audit'
+            self.num_rejected_classifier += 1
+            return 'classifier'
+        return None
+
+    def record_audit(self, status):
+        """
+        Records the outcome of an audited classifier rejection
+
+        Args:
+            status (str): status of the audited evaluation
+
+        Returns:
+            None
+        """
+        self.num_audited += 1
+        if status == 'no_trim':
+            self.num_audited_infeasible += 1
+
+    def summary(self):
+        """
+        Rejection rates and measured classifier precision for the run log
+
+        Args:
+            None
+
+        Returns:
+            summary (str): one line summary
+        """
+        checked = max(self.num_checked, 1)
+        precision = 'n/a'
+        if self.num_audited > 0:
+            precision = '{:.3f}'.format(self.num_audited_infeasible / self.num_audited)
+        return ('Feasibility filter: ' + str(self.num_checked) + ' checked, '
+                + '{:.1%}'.format(self.num_rejected_cache / checked) + ' rejected by negative cache, '
+                + '{:.1%}'.format(self.num_rejected_classifier / checked) + ' by classifier, '
+                + 'classifier precision ' + precision + ' (' + str(self.num_audited) + ' audited)')
@@ -65,6 +65,6 @@ def hcopter_seq():
 
 @ex.automain
 def run(_run, _config):
-    ray.init()
+    ray.init(address=_config['ray_address'])
     conf = Namespace(**_config)
     run_quad_fdm(conf, _run)
\ No newline at end of file
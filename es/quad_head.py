@@ -1,18 +1,36 @@
 import nevergrad as ng
 import numpy as np
-from tqdm import tqdm
 import ray
-import multiprocessing as mp
 from argparse import Namespace
-
-from quad_worker import QuadWorker
+import os
+
+from quad_worker import QuadWorker, PATH_ERROR_SCORE
+from scheduler import Scheduler, ScheduledRun
+from worker_pool import WorkerPool, get_num_workers
+from eval_cache import EvalCache
+from eval_result import EvalResult
+from design_vector import flatten_work, FlatPlan
+from checkpoint import save_checkpoint, load_checkpoint, EvalLog
+from surrogate import Surrogate
+from feasibility import FeasibilityFilter, score_status
+from trim_scores import failure_score
+from component_catalog import PhysicsCheck, load_catalog
+from space_cache import space_id
+from successive_halving import promote, rung_losses
+from artifact_store import run_name
 
 def run_quad_fdm(conf: Namespace, _run=None):
     optim_list = conf.optim_method
+    if conf.portfolio:
+        run_quad_fdm_portfolio(conf, optim_list, _run)
+        return
     for optim in optim_list:
         if conf.pipeline == 'all':
             conf.score_type = 'all'
-            run_quad_fdm_with_optim_all_params(conf, optim, _run)
+            if conf.successive_halving:
+                run_quad_fdm_with_optim_sh(conf, optim, _run)
+            else:
+                run_quad_fdm_with_optim_all_params(conf, optim, _run)
         if conf.pipeline == 'seq':
             # TODO: split budget, could be done in config
             # TODO: optimize on trim and extract best design for trim
@@ -22,9 +40,108 @@ def run_quad_fdm(conf: Namespace, _run=None):
             # TODO: tune control on raw
             conf.score_type = 'all'
             run_quad_fdm_with_optim_seq(conf, 'CMA', _run, vector=best_trim_vector, disc_opt=optim, budget=conf.control_budget)
-            
+
+def run_quad_fdm_portfolio(conf: Namespace, optim_list, _run=None):
+    """
+    Runs all optimizers in optim_list concurrently on one shared worker pool,
+    each optimizer keeps its own npz and optimizer pickle
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optim_list (list[str]): names of the optimizers in the nevergrad registry
+
+    Returns:
+        None
+    """
+    num_workers = get_num_workers(conf)
+    if conf.pipeline == 'all':
+        conf.score_type = 'all'
+        setups = [_setup_all_params(conf, optim, num_workers) for optim in optim_list]
+        conf.artifact_run = run_name([setup[2] for setup in setups])
+        pool = WorkerPool(QuadWorker, conf, num_workers)
+        _optimize(conf, setups, pool.workers, [_warmstart_npz(conf, optim) for optim in optim_list], pool.replace)
+        pool.shutdown()
+    if conf.pipeline == 'seq':
+        # trim phase of all optimizers at once
+        conf.score_type = 'trim'
+        setups = [_setup_seq(conf, optim, num_workers, budget=conf.trim_budget) for optim in optim_list]
+        conf.artifact_run = run_name([setup[2] for setup in setups])
+        pool = WorkerPool(QuadWorker, conf, num_workers)
+        results = _optimize(conf, setups, pool.workers, [_warmstart_npz(conf, optim) for optim in optim_list], pool.replace)
+        pool.shutdown()
+        best_trim_vectors = [_best_trim_vector(conf, *result) for result in results]
+
+        # control phase on the best trim design of each optimizer, workers are restarted with the new score type
+        conf.score_type = 'all'
+        setups = [_setup_seq(conf, 'CMA', num_workers, vector=vector, disc_opt=optim, budget=conf.control_budget) for optim, vector in zip(optim_list, best_trim_vectors)]
+        conf.artifact_run = run_name([setup[2] for setup in setups])
+        pool = WorkerPool(QuadWorker, conf, num_workers)
+        _optimize(conf, setups, pool.workers, recycle=pool.replace)
+        pool.shutdown()
 
 def run_quad_fdm_with_optim_all_params(conf: Namespace, optimizer, _run=None):
+    num_workers = get_num_workers(conf)
+    optim, budget, filename, filename_optim = _setup_all_params(conf, optimizer, num_workers)
+
+    # setting up workers, every phase numbers its evals from 0 and gets its own artifact stores
+    conf.artifact_run = run_name([filename])
+    pool = WorkerPool(QuadWorker, conf, num_workers)
+
+    _optimize(conf, [(optim, budget, filename, filename_optim)], pool.workers, [_warmstart_npz(conf, optimizer)], pool.replace)
+    pool.shutdown()
+
+def run_quad_fdm_with_optim_sh(conf: Namespace, optimizer, _run=None):
+    """
+    Tunes all parameters in the same run with successive halving, every rung of candidates is
+    screened with trim only and the best sh_promote_fraction of the rung gets the full path simulation
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optimizer (str): name of the optimizer in the nevergrad registry
+
+    Returns:
+        None
+    """
+    num_workers = get_num_workers(conf)
+    optim, budget, filename, filename_optim = _setup_all_params(conf, optimizer, num_workers)
+
+    # setting up workers, every phase numbers its evals from 0 and gets its own artifact stores
+    conf.artifact_run = run_name([filename])
+    pool = WorkerPool(QuadWorker, conf, num_workers)
+
+    _optimize_sh(conf, optim, budget, filename, filename_optim, pool.workers, pool.replace)
+    pool.shutdown()
+
+def run_quad_fdm_with_optim_seq(conf: Namespace, optimizer, _run=None, vector=None, disc_opt=None, budget=None):
+    num_workers = get_num_workers(conf)
+    optim, curr_budget, filename, filename_optim = _setup_seq(conf, optimizer, num_workers, vector, disc_opt, budget)
+
+    # setting up workers, every phase numbers its evals from 0 and gets its own artifact stores
+    conf.artifact_run = run_name([filename])
+    pool = WorkerPool(QuadWorker, conf, num_workers)
+
+    # only the design phase can be warm started, the control phase has a different parametrization
+    warmstart_npz = _warmstart_npz(conf, optimizer) if vector is None else None
+    score_all_np, vector_all_np, latvel_all_np = _optimize(conf, [(optim, curr_budget, filename, filename_optim)], pool.workers, [warmstart_npz], pool.replace)[0]
+    pool.shutdown()
+
+    return _best_trim_vector(conf, score_all_np, vector_all_np, latvel_all_np)
+
+def _setup_all_params(conf: Namespace, optimizer, num_workers):
+    """
+    Sets up the optimizer and result paths for tuning all parameters in the same run
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optimizer (str): name of the optimizer in the nevergrad registry
+        num_workers (int): number of parallel evaluations
+
+    Returns:
+        optim (nevergrad.optimizers.base.Optimizer): seeded optimizer
+        budget (int): number of evaluations
+        filename (str): path of the npz file for scores and vectors
+        filename_optim (str): path of the optimizer pickle
+    """
     # seeding
     np.random.seed(conf.seed)
     
@@ -41,8 +158,6 @@ def run_quad_fdm_with_optim_all_params(conf: Namespace, optimizer, _run=None):
     if not os.path.exists(conf.base_folder):
         os.makedirs(conf.base_folder)
 
-    num_cores = mp.cpu_count()
-
     # setting up parameter space
     param = ng.p.Dict()
 
@@ -75,109 +190,36 @@ def run_quad_fdm_with_optim_all_params(conf: Namespace, optimizer, _run=None):
     param['lat_vel'] = ng.p.Array(shape=(conf.design_space['lateral_velocity'][0], ), lower=conf.design_space['lateral_velocity'][1], upper=conf.design_space['lateral_velocity'][2])
     param['vert_vel'] = ng.p.Array(shape=(conf.design_space['vertical_velocity'][0], ), lower=conf.design_space['vertical_velocity'][1], upper=conf.design_space['vertical_velocity'][2])
 
+    if conf.physics_check:
+        _register_physics_check(conf, param)
+
     # setting up optimizer with hyperparams
-    optim = ng.optimizers.registry[optimizer](parametrization=param, budget=conf.budget, num_workers=num_cores)
+    optim = ng.optimizers.registry[optimizer](parametrization=param, budget=conf.budget, num_workers=num_workers)
 
     # seeding
     optim.parametrization.random_state = np.random.RandomState(conf.seed)
     print('Optimizer: ', optim)
 
-    # setting up workers
-    workers = [QuadWorker.remote(conf, worker_id) for worker_id in range(num_cores)]
-
-    # all scores
-    all_scores = []
-    all_individuals = []
-
-    # work distribution loop
-    eval_id = 0
-    for prog in tqdm(range(conf.budget // num_cores)):
-        individuals = [optim.ask() for _ in range(num_cores)]
-        results = []
-
-        # distribute
-        for ind, worker in zip(individuals, workers):
-            work = ind.args[0]
-            work['eval_id'] = eval_id
-            #ind.args[0]['eval_id'] = eval_id
-            worker.run_sim.remote(work)
-            eval_id += 1
-
-        # collect
-        future_results = [worker.collect.remote() for worker in workers]
-        results = ray.get(future_results)
-
-        # update optimization
-        # negate since we want to maximize scores
-        for ind, score in zip(individuals, results):
-            if conf.score_type != 'trim':
-                optim.tell(ind, 1600.0 - np.sum(score))
-            else:
-                optim.tell(ind, np.sum(score[:-1]))
-
-        # collect all
-        all_scores.extend(results)
-        all_individuals.extend(individuals)
-
-        if prog % 10 == 0:
-            score_all_np = np.asarray(all_scores)
-            latvel_all_np = score_all_np[:, -1]
-            score_all_np = score_all_np[:, :-1]
-            if conf.score_type != 'trim':
-                print("Current High Score: " + str(np.max(np.sum(score_all_np, axis=1))))
-                print("At index: " + str(str(np.argmax(np.sum(score_all_np, axis=1)))))
-            else:
-                print('Current Trim Only Best Score: ' + str(np.min(np.sum(score_all_np, axis=1))))
-                print("At index: " + str(str(np.argmin(np.sum(score_all_np, axis=1)))))
-
-            selected_vectors = []
-            for indi in all_individuals:
-                current_vec = []
-                d = indi.args[0]
-                for key in d:
-                    if isinstance(d[key], np.ndarray) or isinstance(d[key], list):
-                        current_vec.extend(list(d[key]))
-                    else:
-                        current_vec.append(d[key])
-                selected_vectors.append(current_vec)
-
-            vector_all_np = np.asarray(selected_vectors)
-            np.savez_compressed(filename, scores=score_all_np, vectors=vector_all_np, latvels=latvel_all_np)
-            # _run.add_artifact(filename)
-            optim.dump(filename_optim)
-            # _run.add_artifact(filename_optim)
-
-    # storing as npz, while running as sacred experiment, the directory iccps_runs should've been created
-    # column 0 is eval 1 score, column 1-3 is eval 3-5 score
-    score_all_np = np.asarray(all_scores)
-    latvel_all_np = score_all_np[:, -1]
-    score_all_np = score_all_np[:, :-1]
-    if not conf.score_type == 'trim':
-        print("Current High Score: " + str(np.max(np.sum(score_all_np, axis=1))))
-        print("At index: " + str(str(np.argmax(np.sum(score_all_np, axis=1)))))
-    else:
-        print('Current Trim Only Best Score: ' + str(np.min(np.sum(score_all_np, axis=1))))
-        print("At index: " + str(str(np.argmin(np.sum(score_all_np, axis=1)))))
-
-    selected_vectors = []
-    for indi in all_individuals:
-        current_vec = []
-        d = indi.args[0]
-        for key in d:
-            if isinstance(d[key], np.ndarray) or isinstance(d[key], list):
-                current_vec.extend(list(d[key]))
-            else:
-                current_vec.append(d[key])
-        selected_vectors.append(current_vec)
-    
-    vector_all_np = np.asarray(selected_vectors)
-    np.savez_compressed(filename, scores=score_all_np, vectors=vector_all_np, latvels=latvel_all_np)
-    # _run.add_artifact(filename)
-    optim.dump(filename_optim)
-    # _run.add_artifact(filename_optim)
-
-def run_quad_fdm_with_optim_seq(conf: Namespace, optimizer, _run=None, vector=None, disc_opt=None, budget=None):
-    
+    return optim, conf.budget, filename, filename_optim
+
+def _setup_seq(conf: Namespace, optimizer, num_workers, vector=None, disc_opt=None, budget=None):
+    """
+    Sets up the optimizer and result paths for one phase of the seq pipeline
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optimizer (str): name of the optimizer in the nevergrad registry
+        num_workers (int): number of parallel evaluations
+        vector (numpy.ndarray, optional): best trim vector, only controls are tuned if given
+        disc_opt (str, optional): name of the optimizer that found vector
+        budget (int, optional): number of evaluations, conf.budget if not given
+
+    Returns:
+        optim (nevergrad.optimizers.base.Optimizer): seeded optimizer
+        budget (int): number of evaluations
+        filename (str): path of the npz file for scores and vectors
+        filename_optim (str): path of the optimizer pickle
+    """
     # seeding
     np.random.seed(conf.seed)
     
@@ -198,8 +240,6 @@ def run_quad_fdm_with_optim_seq(conf: Namespace, optimizer, _run=None, vector=No
     if not os.path.exists(conf.base_folder):
         os.makedirs(conf.base_folder)
 
-    num_cores = mp.cpu_count()
-
     # setting up parameter space, if input vector is specified then only create param for controls
     param = ng.p.Dict()
 
@@ -261,114 +301,556 @@ def run_quad_fdm_with_optim_seq(conf: Namespace, optimizer, _run=None, vector=No
         param['vert_vel'] = [0.0, 0.0, -2.0, 0.0]
 
 
+    if conf.physics_check and vector is None:
+        _register_physics_check(conf, param)
+
     # setting up optimizer with hyperparams
     if budget is not None:
         curr_budget = budget
     else:
         curr_budget = conf.budget
-    optim = ng.optimizers.registry[optimizer](parametrization=param, budget=curr_budget, num_workers=num_cores)
+    optim = ng.optimizers.registry[optimizer](parametrization=param, budget=curr_budget, num_workers=num_workers)
 
     # seeding
     optim.parametrization.random_state = np.random.RandomState(conf.seed)
     print('Optimizer: ', optim)
 
-    # setting up workers
-    workers = [QuadWorker.remote(conf, worker_id) for worker_id in range(num_cores)]
+    return optim, curr_budget, filename, filename_optim
+
+def _register_physics_check(conf: Namespace, param):
+    """
+    Constrains the component choices of a parametrization with the static physics check
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        param (nevergrad.p.Dict): parametrization with battery, esc, motor and prop choices
+
+    Returns:
+        None
+    """
+    check = PhysicsCheck(load_catalog(conf), conf.physics_checks, conf.frame_mass, conf.min_thrust_to_weight)
+    print('Physics check rejects {:.1%} of random designs'.format(check.rejected_fraction(conf.design_space, seed=conf.seed)))
+    param.register_cheap_constraint(check)
+
+def _optimize(conf: Namespace, setups, workers, warmstart_npzs=None, recycle=None):
+    """
+    Runs the ask/tell loops of one or several optimizers on the shared worker pool and saves the results
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        setups (list[tuple]): (optim, budget, filename, filename_optim) of each optimizer
+        workers (list[QuadWorker]): ray worker handles
+        warmstart_npzs (list[str], optional): result file to warm start each optimizer from, None entries are not warm started
+        recycle (callable(worker) -> worker, optional): replaces worn out workers, e.g. WorkerPool.replace
+
+    Returns:
+        results (list[tuple]): (score_all_np, vector_all_np, latvel_all_np) of each optimizer
+    """
+    for folder in ['iccps_runs/checkpoints', 'iccps_runs/evals']:
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    # eval ids are shared so that concurrent optimizers don't write to the same eval folder
+    eval_ids = _EvalIds()
+    cache = None
+    if conf.eval_cache is not None:
+        cache = EvalCache(conf.eval_cache)
+    surrogates = []
+    eval_logs = []
+    runs = []
+    if warmstart_npzs is None:
+        warmstart_npzs = len(setups) * [None]
+    for (optim, budget, filename, filename_optim), warmstart_npz in zip(setups, warmstart_npzs):
+        surrogate = None
+        if conf.surrogate is not None:
+            surrogate = Surrogate(conf.surrogate, conf.surrogate_min_samples, conf.surrogate_retrain_every, conf.seed)
+            surrogates.append(surrogate)
+        # only the trim phase over component choices is filtered
+        feasibility = None
+        if conf.feasibility_filter and conf.score_type == 'trim' and 'trim_discrete_baseline' not in optim.parametrization.value:
+            feasibility = FeasibilityFilter(conf.design_space, conf.feasibility_threshold, conf.feasibility_min_samples,
+                                            conf.feasibility_retrain_every, conf.feasibility_audit, conf.seed)
+        eval_log = EvalLog(_eval_log_path(filename))
+        eval_logs.append(eval_log)
+        state = None
+        if conf.resume:
+            state = load_checkpoint(_checkpoint_path(filename))
+        if state is not None:
+            # the restored optimizer already contains the warm start
+            print('Resuming ' + filename + ' at evaluation ' + str(state['num_told']))
+            run = _make_run(conf, state['optim'], budget, filename, filename_optim, eval_ids, eval_log, cache, state=state,
+                            surrogate=surrogate, feasibility=feasibility)
+            np.random.set_state(state['np_random_state'])
+            runs.append(run)
+            continue
+
+        prior = ([], [])
+        if warmstart_npz is not None:
+            prior = _warmstart(conf, optim, warmstart_npz)
+            if conf.warmstart_count_budget:
+                budget = max(budget - len(prior[0]), 0)
+            else:
+                # prior evaluations are told but not logged again, the filters still learn from them
+                plan = FlatPlan(optim.parametrization.value)
+                for score, ind in zip(*prior):
+                    if surrogate is not None:
+                        surrogate.add(plan.flatten(ind.args[0]), _loss(conf, score))
+                    if feasibility is not None:
+                        feasibility.add(ind.args[0], score, score_status(score))
+                prior = ([], [])
+        runs.append(_make_run(conf, optim, budget, filename, filename_optim, eval_ids, eval_log, cache, prior=prior,
+                              surrogate=surrogate, feasibility=feasibility))
+
+    scheduler = Scheduler(workers, conf.scheduler, conf.evals_per_worker, conf.portfolio_window, conf.portfolio_min_share,
+                          conf.speculative, recycle, conf.recycle_after, conf.max_worker_rss_mb)
+    scheduler.run_portfolio(runs, checkpoint_every=10)
+    if cache is not None:
+        print('Eval cache hits: ' + str(cache.num_hits) + ', misses: ' + str(cache.num_misses))
+        cache.close()
+    for surrogate in surrogates:
+        surrogate.close()
+    for eval_log in eval_logs:
+        eval_log.close()
 
+    # storing as npz, while running as sacred experiment, the directory iccps_runs should've been created
+    # column 0 is eval 1 score, column 1-3 is eval 3-5 score
+    # the final checkpoint marks the runs as finished for a resume
+    return [run.checkpoint() for run in runs]
+
+def _make_run(conf: Namespace, optim, budget, filename, filename_optim, eval_ids, eval_log, cache=None, prior=None, state=None,
+              surrogate=None, feasibility=None):
+    """
+    Wraps an optimizer into a run for the scheduler, with its own log of scores and individuals
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optim (nevergrad.optimizers.base.Optimizer): optimizer to run
+        budget (int): number of evaluations
+        filename (str): path of the npz file for scores and vectors
+        filename_optim (str): path of the optimizer pickle
+        eval_ids (_EvalIds): source of unique eval ids
+        eval_log (EvalLog): log of the finished evaluations of the run, closed by the caller
+        cache (EvalCache, optional): evaluations found in the cache are not simulated again
+        prior (tuple(list, list), optional): scores and individuals of warm start evaluations to log
+        state (dict, optional): checkpoint to resume from, evaluations in flight at the checkpoint are dispatched again
+        surrogate (Surrogate, optional): once fitted, conf.surrogate_overask candidates are asked per
+            simulated candidate, the one with the lowest predicted loss minus conf.surrogate_kappa times
+            its uncertainty is simulated and the others are told their predicted loss
+        feasibility (FeasibilityFilter, optional): asked candidates it rejects are told the no trim loss
+            without being simulated, up to conf.feasibility_max_rejects in a row
+
+    Returns:
+        run (ScheduledRun): run for the scheduler, its checkpoint callback saves the results and returns them as in _save_results
+    """
     # all scores
     all_scores = []
     all_individuals = []
-
-    # work distribution loop
-    eval_id = 0
-    for prog in tqdm(range(curr_budget // num_cores)):
-        individuals = [optim.ask() for _ in range(num_cores)]
-        results = []
-
-        # distribute
-        for ind, worker in zip(individuals, workers):
-            work = ind.args[0]
-            work['eval_id'] = eval_id
-            #ind.args[0]['eval_id'] = eval_id
-            worker.run_sim.remote(work)
-            eval_id += 1
-
-        # collect
-        future_results = [worker.collect.remote() for worker in workers]
-        results = ray.get(future_results)
-
-        # update optimization
-        # negate since we want to maximize scores
-        for ind, score in zip(individuals, results):
-            if conf.score_type != 'trim':
-                optim.tell(ind, 1600.0 - np.sum(score))
-            else:
-                optim.tell(ind, np.sum(score[:-1]))
+    if prior is not None:
+        all_scores.extend(prior[0])
+        all_individuals.extend(prior[1])
+
+    # compiled once per run, shared by the surrogate, the eval log and the result files
+    plan = FlatPlan(optim.parametrization.value)
+    recovered = {}
+    if state is not None:
+        all_scores.extend(state['all_scores'])
+        all_individuals.extend(state['all_individuals'])
+        eval_ids.next_id = max(eval_ids.next_id, state['next_eval_id'])
+        # evaluations in flight at the checkpoint that finished before the crash are not simulated again
+        recovered = eval_log.truncate(state['next_eval_id'])
+    else:
+        eval_log.truncate(0)
+    for score, ind in zip(all_scores, all_individuals):
+        if surrogate is not None:
+            surrogate.add(plan.flatten(ind.args[0]), _loss(conf, score))
+        if feasibility is not None:
+            feasibility.add(ind.args[0], score, score_status(score))
+    num_filtered = 0
+    # ids of candidates rejected by the classifier and simulated anyway
+    audited = set()
+
+    def ask_feasible():
+        ind = optim.ask()
+        if feasibility is None:
+            return ind
+        for _ in range(conf.feasibility_max_rejects):
+            reason = feasibility.check(ind.args[0])
+            if reason is None:
+                return ind
+            if reason == 'audit':
+                audited.add(id(ind))
+                return ind
+            optim.tell(ind, _loss(conf, failure_score(conf.trim_score)))
+            ind = optim.ask()
+        return ind
+
+    def ask():
+        nonlocal num_filtered
+        if surrogate is not None and surrogate.ready():
+            inds = [ask_feasible() for _ in range(conf.surrogate_overask)]
+            mean, std = surrogate.predict(plan.flatten_batch([ind.args[0] for ind in inds]))
+            best = np.argmin(mean - conf.surrogate_kappa * std)
+            for i, ind in enumerate(inds):
+                if i != best:
+                    optim.tell(ind, mean[i])
+            num_filtered += len(inds) - 1
+            ind = inds[best]
+        else:
+            ind = ask_feasible()
+        work = ind.args[0]
+        work['eval_id'] = next(eval_ids)
+        return ind, work
+
+    def submit(worker, cand):
+        ind, work = cand
+        return worker.run_sim.remote(work)
+
+    def submit_copy(worker, cand):
+        # the copy gets its own eval folder, results are still logged under the original eval id
+        ind, work = cand
+        work_copy = dict(work)
+        work_copy['eval_id'] = next(eval_ids)
+        return worker.run_sim.remote(work_copy)
+
+    def tell(cand, result):
+        ind, work = cand
+        score = result.score
+        loss = _loss(conf, score)
+        optim.tell(ind, loss)
+        vector = plan.flatten(work)
+        # results replayed from the log on resume are already in it
+        if not result.info.get('recovered', False):
+            eval_log.append(work['eval_id'], score, result.status, vector)
+        if surrogate is not None:
+            surrogate.add(vector, loss)
+        if feasibility is not None:
+            # cache hits and results recovered from the eval log carry their stored status
+            feasibility.add(work, score, result.status)
+            if id(ind) in audited:
+                audited.discard(id(ind))
+                if result.status not in ['error', 'timeout']:
+                    feasibility.record_audit(result.status)
+
+        # errors may be transient, only deterministic results are cached
+        if cache is not None and result.status in ['ok', 'no_trim'] and not result.info.get('cached', False):
+            cache.put(_cache_key(conf, work), score, result.status)
 
         # collect all
-        all_scores.extend(results)
-        all_individuals.extend(individuals)
-
-        if prog % 10 == 0:
-            score_all_np = np.asarray(all_scores)
-            latvel_all_np = score_all_np[:, -1]
-            score_all_np = score_all_np[:, :-1]
-            if conf.score_type != 'trim':
-                print("Current High Score: " + str(np.max(np.sum(score_all_np, axis=1))))
-                print("At index: " + str(str(np.argmax(np.sum(score_all_np, axis=1)))))
-            else:
-                print('Current Trim Only Best Score: ' + str(np.min(np.sum(score_all_np, axis=1))))
-                print("At index: " + str(str(np.argmin(np.sum(score_all_np, axis=1)))))
-
-            selected_vectors = []
-            for indi in all_individuals:
-                current_vec = []
-                d = indi.args[0]
-                for key in d:
-                    if isinstance(d[key], np.ndarray) or isinstance(d[key], list):
-                        current_vec.extend(list(d[key]))
-                    else:
-                        current_vec.append(d[key])
-                selected_vectors.append(current_vec)
-
-            vector_all_np = np.asarray(selected_vectors)
-            np.savez_compressed(filename, scores=score_all_np, vectors=vector_all_np, latvels=latvel_all_np)
-            # _run.add_artifact(filename)
-            optim.dump(filename_optim)
-            # _run.add_artifact(filename_optim)
+        all_scores.append(score)
+        all_individuals.append(ind)
+        return loss
+
+    def lookup(cand):
+        ind, work = cand
+        if work['eval_id'] in recovered:
+            entry = recovered.pop(work['eval_id'])
+            return EvalResult(work['eval_id'], -1, entry['score'], entry['status'], info={'recovered': True})
+        if cache is None:
+            return None
+        score, status = cache.get(_cache_key(conf, work))
+        if score is None:
+            return None
+        return EvalResult(work['eval_id'], -1, score, status, info={'cached': True})
+
+    def checkpoint():
+        if surrogate is not None:
+            print('Surrogate filtered ' + str(num_filtered) + ' candidates')
+        if feasibility is not None:
+            print(feasibility.summary())
+        results = _save_results(conf, optim, all_scores, all_individuals, filename, filename_optim)
+        # optimizer and in-flight candidates are pickled together so they keep referring to each other
+        save_checkpoint(_checkpoint_path(filename), {
+            'optim': optim,
+            'in_flight': list(run.in_flight.values()),
+            'all_scores': all_scores,
+            'all_individuals': all_individuals,
+            'num_asked': run.num_asked,
+            'num_told': run.num_told,
+            'best_history': run.best_history,
+            'next_eval_id': eval_ids.next_id,
+            'np_random_state': np.random.get_state()})
+        return results
+
+    run = ScheduledRun(filename.split('/')[-1], ask, submit, tell, budget, checkpoint, lookup=lookup, submit_copy=submit_copy)
+    if state is not None:
+        run.num_asked = state['num_asked']
+        run.num_told = state['num_told']
+        run.best_history = state['best_history']
+        run.pending = state['in_flight']
+    return run
+
+def _optimize_sh(conf: Namespace, optim, budget, filename, filename_optim, workers, recycle=None):
+    """
+    Successive halving loop, budget counts candidates asked from the optimizer, of which only
+    about sh_promote_fraction are simulated on paths
+
+    Candidates promoted to paths are told their path loss, the others are told a loss worse than
+    the one of a failed path simulation, which keeps their trim ranking, see rung_losses.
+
+    Args:
+        conf (argparse.Namespace): experiment config, score_type has to be 'all'
+        optim (nevergrad.optimizers.base.Optimizer): optimizer to run
+        budget (int): number of candidates
+        filename (str): path of the npz file for scores and vectors
+        filename_optim (str): path of the optimizer pickle
+        workers (list[QuadWorker]): ray worker handles
+        recycle (callable(worker) -> worker, optional): replaces worn out workers, e.g. WorkerPool.replace
+
+    Returns:
+        results (tuple): (score_all_np, vector_all_np, latvel_all_np) as in _save_results
+    """
+    eval_ids = _EvalIds()
+    cache = None
+    if conf.eval_cache is not None:
+        cache = EvalCache(conf.eval_cache)
+    scheduler = Scheduler(workers, conf.scheduler, conf.evals_per_worker, speculative=conf.speculative,
+                          recycle=recycle, recycle_after=conf.recycle_after, max_rss_mb=conf.max_worker_rss_mb)
+    rung_size = conf.sh_rung_size if conf.sh_rung_size is not None else 4 * len(scheduler.slots)
 
-    # storing as npz, while running as sacred experiment, the directory iccps_runs should've been created
-    # column 0 is eval 1 score, column 1-3 is eval 3-5 score
+    # all scores
+    all_scores = []
+    all_individuals = []
+    num_trims = 0
+    num_paths = 0
+    while len(all_individuals) < budget:
+        rung = [optim.ask() for _ in range(min(rung_size, budget - len(all_individuals)))]
+        works = [ind.args[0] for ind in rung]
+
+        # trim screening of the whole rung
+        trims = _evaluate_sh(conf, scheduler, works, 'trim', eval_ids, cache)
+        num_trims += len(rung)
+
+        # only designs that trimmed are worth a path simulation
+        trim_losses = np.array([np.sum(result.score[:-1]) for result in trims])
+        promoted = promote(trim_losses, [result.status == 'ok' for result in trims], conf.sh_promote_fraction)
+
+        paths = _evaluate_sh(conf, scheduler, [works[i] for i in promoted], 'all', eval_ids, cache)
+        num_paths += len(promoted)
+        path_scores = {i: result.score for i, result in zip(promoted, paths)}
+        losses = rung_losses(trim_losses, {i: _loss(conf, score) for i, score in path_scores.items()},
+                             _loss(conf, PATH_ERROR_SCORE))
+
+        for i, ind in enumerate(rung):
+            # not promoted designs are stored with the score the worker gives a design without trim
+            score = path_scores.get(i, [0.0, 0.0, 0.0, 0.0])
+            optim.tell(ind, losses[i])
+
+            # collect all
+            all_scores.append(score)
+            all_individuals.append(ind)
+        print('Successive halving: ' + str(num_trims) + ' trim and ' + str(num_paths) + ' path simulations')
+        _save_results(conf, optim, all_scores, all_individuals, filename, filename_optim)
+
+    if cache is not None:
+        print('Eval cache hits: ' + str(cache.num_hits) + ', misses: ' + str(cache.num_misses))
+        cache.close()
+    return _save_results(conf, optim, all_scores, all_individuals, filename, filename_optim)
+
+def _evaluate_sh(conf: Namespace, scheduler, works, score_type, eval_ids, cache=None):
+    """
+    Evaluates a list of candidates at one fidelity on the worker pool
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        scheduler (Scheduler): scheduler of the worker pool
+        works (list[dict]): candidate work dicts
+        score_type (str): fidelity, one of ['trim', 'all']
+        eval_ids (_EvalIds): source of unique eval ids
+        cache (EvalCache, optional): evaluations found in the cache are not simulated again
+
+    Returns:
+        results (list[EvalResult]): results in the order of works
+    """
+    # every fidelity of a candidate gets its own eval folder
+    queue = [dict(work, eval_id=next(eval_ids)) for work in works]
+    results = {}
+
+    def submit(worker, work):
+        return worker.run_sim.remote(work, score_type)
+
+    def submit_copy(worker, work):
+        return worker.run_sim.remote(dict(work, eval_id=next(eval_ids)), score_type)
+
+    def tell(work, result):
+        results[work['eval_id']] = result
+        # errors may be transient, only deterministic results are cached
+        if cache is not None and result.status in ['ok', 'no_trim'] and not result.info.get('cached', False):
+            cache.put(_cache_key(conf, work, score_type), result.score, result.status)
+        # losses of a rung are told by _optimize_sh once all fidelities are in
+        return None
+
+    def lookup(work):
+        if cache is None:
+            return None
+        score, status = cache.get(_cache_key(conf, work, score_type))
+        if score is None:
+            return None
+        return EvalResult(work['eval_id'], -1, score, status, info={'cached': True})
+
+    run = ScheduledRun(score_type, iter(queue).__next__, submit, tell, len(queue), lookup=lookup, submit_copy=submit_copy)
+    scheduler.run_portfolio([run])
+    return [results[work['eval_id']] for work in queue]
+
+class _EvalIds:
+    """
+    Source of unique eval ids, its position is saved in checkpoints
+    """
+    def __init__(self):
+        self.next_id = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        eval_id = self.next_id
+        self.next_id += 1
+        return eval_id
+
+def _checkpoint_path(filename):
+    return 'iccps_runs/checkpoints/' + filename.split('/')[-1][:-len('.npz')] + '_ckpt.pkl'
+
+def _eval_log_path(filename):
+    return 'iccps_runs/evals/' + filename.split('/')[-1][:-len('.npz')] + '.jsonl'
+
+def _loss(conf: Namespace, score):
+    """
+    Objective value told to the optimizer for a score vector
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        score (list[float]): score vector returned by the worker
+
+    Returns:
+        loss (float): value to minimize
+    """
+    # negate since we want to maximize scores
+    if conf.score_type != 'trim':
+        return 1600.0 - np.sum(score)
+    else:
+        return np.sum(score[:-1])
+
+def _warmstart_npz(conf: Namespace, optimizer):
+    """
+    Name of the result file an optimizer is warm started from, warmstart_npzs is aligned with optim_method
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optimizer (str): name of the optimizer
+
+    Returns:
+        npz (str): name of the npz file in iccps_runs/npzs without extension, None if not warm started
+    """
+    if not conf.warmstart_with_npz or optimizer not in conf.optim_method:
+        return None
+    return conf.warmstart_npzs[conf.optim_method.index(optimizer)]
+
+def _warmstart(conf: Namespace, optim, npz):
+    """
+    Tells optim the evaluations stored in a previous result file, before its first ask
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optim (nevergrad.optimizers.base.Optimizer): optimizer to warm start
+        npz (str): name of the npz file in iccps_runs/npzs without extension
+
+    Returns:
+        prior_scores (list[list[float]]): score vectors of the prior evaluations
+        prior_individuals (list[nevergrad.p.Parameter]): candidates of the prior evaluations
+    """
+    path = 'iccps_runs/npzs/' + npz + '.npz'
+    if not os.path.exists(path):
+        print('Warm start file ' + path + ' not found, starting ' + npz + ' cold')
+        return [], []
+    data = np.load(path)
+    plan = FlatPlan(optim.parametrization.value)
+    if 'slots' in data.files and list(data['slots']) != plan.slot_names:
+        print('Slots of ' + npz + ' do not match the parametrization, rows are mapped by position')
+
+    prior_scores = []
+    prior_individuals = []
+    for scores, vector, latvel in zip(data['scores'], data['vectors'], data['latvels']):
+        # scores are stored without their last column
+        score = list(scores) + [latvel]
+        try:
+            ind = optim.parametrization.spawn_child(new_value=plan.unflatten(vector))
+        except ValueError as e:
+            print('Skipping warm start row: ' + str(e))
+            continue
+        optim.tell(ind, _loss(conf, score))
+        prior_scores.append(score)
+        prior_individuals.append(ind)
+
+    print('Warm started with ' + str(len(prior_scores)) + ' evaluations from ' + npz)
+    return prior_scores, prior_individuals
+
+def _cache_key(conf: Namespace, work, score_type=None):
+    """
+    Key of a candidate in the evaluation cache
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        work (dict): candidate work dict
+        score_type (str, optional): fidelity of the evaluation, conf.score_type if not given
+
+    Returns:
+        key (str): cache key of the candidate
+    """
+    if score_type is None:
+        score_type = conf.score_type
+    # scores of another trim score function or design space have another meaning
+    return EvalCache.make_key(flatten_work(work), score_type, conf.vehicle, [conf.trim_score, space_id(conf.acel_path)])
+
+def _best_trim_vector(conf: Namespace, score_all_np, vector_all_np, latvel_all_np):
+    """
+    Extracts the best design of a trim run, used as baseline for control tuning
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        score_all_np (numpy.ndarray (N, M)): scores of all evaluations
+        vector_all_np (numpy.ndarray (N, K)): vectors of all evaluations
+        latvel_all_np (numpy.ndarray (N, )): max lateral velocities of all evaluations
+
+    Returns:
+        best_vec (numpy.ndarray): discrete and continuous design of the best trim, with its max lateral velocity, None if not a trim run
+    """
+    if conf.score_type == 'trim':
+        best_ind = np.argmin(np.sum(score_all_np, axis=1))
+        best_vec = np.append(vector_all_np[best_ind, :-28], latvel_all_np[best_ind])
+        return best_vec
+    else:
+        return None
+
+def _save_results(conf: Namespace, optim, all_scores, all_individuals, filename, filename_optim):
+    """
+    Prints the current best score, saves all evaluations as npz and dumps the optimizer
+
+    Args:
+        conf (argparse.Namespace): experiment config
+        optim (nevergrad.optimizers.base.Optimizer): optimizer to dump
+        all_scores (list[list[float]]): scores of all evaluations so far
+        all_individuals (list[nevergrad.p.Parameter]): candidates of all evaluations so far
+        filename (str): path of the npz file for scores and vectors
+        filename_optim (str): path of the optimizer pickle
+
+    Returns:
+        score_all_np (numpy.ndarray (N, M)): scores of all evaluations
+        vector_all_np (numpy.ndarray (N, K)): vectors of all evaluations
+        latvel_all_np (numpy.ndarray (N, )): last column of scores
+    """
     score_all_np = np.asarray(all_scores)
     latvel_all_np = score_all_np[:, -1]
     score_all_np = score_all_np[:, :-1]
-    if not conf.score_type == 'trim':
+    if conf.score_type != 'trim':
         print("Current High Score: " + str(np.max(np.sum(score_all_np, axis=1))))
         print("At index: " + str(str(np.argmax(np.sum(score_all_np, axis=1)))))
     else:
         print('Current Trim Only Best Score: ' + str(np.min(np.sum(score_all_np, axis=1))))
         print("At index: " + str(str(np.argmin(np.sum(score_all_np, axis=1)))))
 
-    selected_vectors = []
-    for indi in all_individuals:
-        current_vec = []
-        d = indi.args[0]
-        for key in d:
-            if isinstance(d[key], np.ndarray) or isinstance(d[key], list):
-                current_vec.extend(list(d[key]))
-            else:
-                current_vec.append(d[key])
-        selected_vectors.append(current_vec)
-    
-    vector_all_np = np.asarray(selected_vectors)
-    np.savez_compressed(filename, scores=score_all_np, vectors=vector_all_np, latvels=latvel_all_np)
+    plan = FlatPlan(optim.parametrization.value)
+    vector_all_np = plan.flatten_batch([indi.args[0] for indi in all_individuals])
+    np.savez_compressed(filename, scores=score_all_np, vectors=vector_all_np, latvels=latvel_all_np, slots=plan.schema())
     # _run.add_artifact(filename)
     optim.dump(filename_optim)
     # _run.add_artifact(filename_optim)
-
-    if conf.score_type == 'trim':
-        best_ind = np.argmin(np.sum(score_all_np, axis=1))
-        best_vec = np.append(vector_all_np[best_ind, :-28], latvel_all_np[best_ind])
-        return best_vec
-    else:
-        return None
+    return score_all_np, vector_all_np, latvel_all_np
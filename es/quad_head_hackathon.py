@@ -259,16 +259,16 @@ def run_quad_fdm(conf: Namespace, _run=None):
         results = []
 
         # distribute
+        future_results = []
         for ind, worker in zip(individuals, workers):
             work = ind.args[0]
             work['eval_id'] = eval_id
             #ind.args[0]['eval_id'] = eval_id
-            worker.run_sim.remote(work)
+            future_results.append(worker.run_sim.remote(work))
             eval_id += 1
 
         # collect
-        future_results = [worker.collect.remote() for worker in workers]
-        results = ray.get(future_results)
+        results = [result.score for result in ray.get(future_results)]
 
         # update optimization
         # negate since we want to maximize scores
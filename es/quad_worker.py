@@ -2,8 +2,10 @@ import ray
 import numpy as np
 import os
 import sys
-import shutil
+import time
 from itertools import cycle
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from quadspider import construct_baseline_quad_spider_design
 from quad import construct_baseline_quad_rotor_design
@@ -12,12 +14,23 @@ from hexring import construct_baseline_hexring_design
 from hex import construct_baseline_hex_rotor_design
 from hplane import construct_baseline_hplane_design
 #from design1 import construct_design
-from prob_design_generator.space import DesignSpace
+from space_cache import load_design_space, space_id
 from uav_simulator.simulation import Simulation
-from multiprocessing import Process
-from multiprocessing import Manager
+from scratch import Janitor
+from affinity import pin_worker
+from worker_health import process_usage
+from artifact_store import ArtifactStore
+from sim_process import SimulationChild, SIM_PRELOAD, run_simulation
 import pickle as pk
 
+from eval_result import EvalResult
+from trim_scores import score_trims, failure_score, TIMEOUT
+from design_vector import flatten_work, structure_key, work_controls, FlatPlan, PATHS, CONTROL_KEYS
+from eval_cache import EvalCache
+
+# path scores of an evaluation that failed, the worst a path simulation reports
+PATH_ERROR_SCORE = [-1000.0, -1000.0, -1000.0, -1000.0]
+
 @ray.remote
 class QuadWorker:
     """
@@ -29,12 +42,45 @@ class QuadWorker:
         # self.max_distance = 0.0
         # self.max_hover_time = 0.0
         self.score = []
-        self.eval_done = False
 
         self.conf = conf
         self.worker_id = worker_id
 
         self.sim = None
+        # parsed once per node, see space_cache
+        self.space = load_design_space(self.conf.acel_path, self.conf.design_space_cache)
+
+        # own cores for the worker and its simulation children
+        self.cores, self.core_lock = None, None
+        if self.conf.pin_cores:
+            self.cores, self.core_lock = pin_worker(int(np.ceil(self.conf.cpus_per_eval)))
+
+        # long lived simulation child, null sim_child_max_evals forks a new child per evaluation
+        self.sim_child = None
+        if self.conf.sim_child_max_evals is not None:
+            self.sim_child = SimulationChild(SIM_PRELOAD, self.conf.sim_child_max_evals)
+
+        # eval folders are written to conf.scratch_root if set and cleaned up in the background
+        self.janitor = Janitor(self.conf.scratch_root)
+        # base folder -> ArtifactStore of the design graphs
+        self.stores = {}
+        # structure_key -> design graph, LRU, reused by candidates that only change controls
+        self.structures = OrderedDict()
+        # path scores by structure and controls of the path, only changed paths are simulated
+        self.path_cache = None
+        if self.conf.path_cache is not None:
+            self.path_cache = EvalCache(self.conf.path_cache)
+        # keys of a work dict -> (FlatPlan, slots of the structure entries), compiled on first use
+        self.plans = {}
+        # response keys of the last path simulation, in the order of self.score
+        self.score_keys = []
+        # one simulation child per path if paths are simulated in parallel, see _simulate_parallel
+        self.path_children = None
+        if self.conf.parallel_paths:
+            self.path_children = {path: None for path in PATHS}
+            if self.conf.sim_child_max_evals is not None:
+                self.path_children = {path: SimulationChild(SIM_PRELOAD, self.conf.sim_child_max_evals) for path in PATHS}
+            self.path_threads = ThreadPoolExecutor(max_workers=len(PATHS))
 
         self.mapping = {
             "quadspider": construct_baseline_quad_spider_design,
@@ -51,129 +97,321 @@ class QuadWorker:
         Updates the worker's score when in trim only scenario
 
         Args:
-            responses (dict{pandas.DataFrame}): return from simulation
+            responses (dict{numpy.ndarray}): compact trim tables from simulation, see sim_responses
 
         Returns:
             None
         """
-        # if response is empty, trim is not found
-        if not bool(responses):
-            self.score = 5 * [99999.]
-            return
+        # conf.trim_score selects the score function, see trim_scores
+        self.score = score_trims(self.conf.trim_score, responses)
 
-        # forward trim
-        forward_df = responses['forward']
-        forward_dist_obj = (2000.0 - forward_df['Distance'].max())
-        forward_time_obj = (410.0 - forward_df['Flight time'].max())
-        forward_frac_obj = 500.0 * (forward_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
+    def run_sim(self, raw_work, score_type=None):
+        """
+        Runs the full SwRI simulation with LQR parameters
 
-        # turn radius 500 trim
-        turn_500_df = responses['turn_500']
-        turn_500_dist_obj = (3142.0 - turn_500_df['Distance'].max())
-        turn_500_frac_obj = 500.0 * (turn_500_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
+        Args:
+            raw_work (numpy.ndarray (N, )): sampled current candidate, size dependends on vehicle
+            score_type (str, optional): one of ['trim', 'all'], overrides conf.score_type for this evaluation
+
+        Returns:
+            result (EvalResult): score vector and status of the evaluation
+        """
+        start = time.time()
+        if score_type is None:
+            score_type = self.conf.score_type
+
+        try:
+            design_graph = self._build_design(raw_work)
+        except Exception as e:
+            print(e)
+            self._set_error_score(score_type)
+            return self._report(EvalResult(raw_work['eval_id'], self.worker_id, self.score, 'error', time.time() - start))
+        if score_type == 'all' and self.path_cache is not None and structure_key(raw_work) is not None:
+            return self._report(self._simulate_paths(design_graph, raw_work, start))
+        return self._report(self._simulate(design_graph, raw_work['eval_id'], score_type, self.conf.base_folder, start))
 
-        # turn radius 300 trim
-        turn_300_df = responses['turn_300']
-        turn_300_dist_obj = (3500.0 - turn_300_df['Distance'].max())
-        turn_300_speed_obj = -300 * turn_300_df['Speed'].max()
-        turn_300_frac_obj = 500.0 * (turn_300_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
-        self.score = [forward_frac_obj, turn_500_frac_obj, turn_300_frac_obj, turn_300_speed_obj, self._get_max_latvel(responses)]
-        #self.score = [forward_dist_obj, forward_time_obj, forward_frac_obj, turn_500_dist_obj, turn_500_frac_obj, turn_300_dist_obj, turn_300_speed_obj, turn_300_frac_obj]
-        if np.any(np.isnan(self.score)):
-            self.score = 5 * [99999.]
+    def _plan(self, raw_work):
+        keys = tuple(raw_work.keys())
+        if keys not in self.plans:
+            plan = FlatPlan(raw_work)
+            self.plans[keys] = (plan, plan.slots([key for key in keys if key not in CONTROL_KEYS]))
+        return self.plans[keys]
 
-    def _get_max_latvel(self, responses):
+    def _path_key(self, raw_work, path):
+        # structure of the design plus the LQR weights and velocities of this path only
+        plan, structure_slots = self._plan(raw_work)
+        structure = plan.flatten(raw_work)[structure_slots]
+        return EvalCache.make_key(np.append(structure, list(work_controls(raw_work)[path].values())), path, self.conf.vehicle,
+                                  [space_id(self.conf.acel_path)])
+
+    def _simulate_paths(self, design_graph, raw_work, start):
         """
-        Extracts maximum velocities from trim responses
+        Simulates only the paths whose controls changed since they were last scored for this
+        structure, the other path scores come from the path cache
 
         Args:
-            responses (dict{pandas.DataFrame}): return from simulation
+            design_graph (networkx.DiGraph): design graph with all paths
+            raw_work (dict): sampled current candidate
+            start (float): start time of the evaluation
 
         Returns:
-            max_latvel (float): maximum lateral velocity found in trim responses
+            result (EvalResult): path scores in the order of design_vector.PATHS
         """
-        five_max = responses['turn_500']['Speed'].max()
-        three_max = responses['turn_300']['Speed'].max()
-        return max(five_max, three_max)
+        eval_id = raw_work['eval_id']
+        keys = {path: self._path_key(raw_work, path) for path in PATHS}
+        cached = {path: self.path_cache.get(keys[path]) for path in PATHS}
+        scores = {path: score for path, (score, _) in cached.items()}
+        missing = [path for path in PATHS if scores[path] is None]
+        if not missing:
+            # a design without trim has no trim on any path
+            status = 'no_trim' if all([status == 'no_trim' for _, status in cached.values()]) else 'ok'
+            return EvalResult(eval_id, self.worker_id, [scores[path][0] for path in PATHS], status, time.time() - start,
+                              info={'cached': True})
+
+        # the simulator runs the paths in graph.graph
+        design_graph = design_graph.copy()
+        for path in PATHS:
+            if path not in missing:
+                design_graph.graph.pop(path, None)
+        result = self._simulate(design_graph, eval_id, 'all', self.conf.base_folder, start)
 
-    def run_sim(self, raw_work):
+        if result.status == 'no_trim':
+            new_scores = [0.0 for _ in missing]
+        elif result.status == 'ok' and all(key in missing for key in self.score_keys):
+            new_scores = [result.score[self.score_keys.index(path)] if path in self.score_keys else 0.0 for path in missing]
+        elif result.status == 'ok' and len(result.score) == len(missing):
+            # response keys are not path names, responses come in graph order
+            new_scores = result.score
+        elif result.status in ['error', 'timeout']:
+            # errors and timeouts may be transient and are not cached
+            return result
+        else:
+            # scores that cannot be matched to the paths would misalign the score vector
+            print('Cannot match ' + str(len(result.score)) + ' scores to paths ' + str(missing))
+            self._set_error_score('all')
+            result.score = self.score
+            result.status = 'error'
+            return result
+        for path, score in zip(missing, new_scores):
+            self.path_cache.put(keys[path], [score], result.status)
+            scores[path] = [score]
+        result.score = [scores[path][0] for path in PATHS]
+        return result
+
+    def _build_design(self, raw_work):
         """
-        Runs the full SwRI simulation with LQR parameters
+        Builds the design graph of a candidate, a candidate that only changes the controls of a
+        recently built structure gets a copy of that graph with its own controls
 
         Args:
-            raw_work (numpy.ndarray (N, )): sampled current candidate, size dependends on vehicle
+            raw_work (dict): sampled current candidate
+
+        Returns:
+            design_graph (networkx.DiGraph): design graph with components and controls
+        """
+        key = None
+        if self.conf.structure_cache_size:
+            key = structure_key(raw_work)
+        if key is not None and key in self.structures:
+            self.structures.move_to_end(key)
+            # copies the graph and node attribute dicts, components are shared and never modified
+            design_graph = self.structures[key].copy()
+            design_graph.graph.update(work_controls(raw_work))
+            return design_graph
+
+        callback = self.mapping[self.conf.vehicle]
+        design_graph = callback(self.space, flatten_work(raw_work), is_selected=True)
+        if key is not None:
+            self.structures[key] = design_graph
+            if len(self.structures) > self.conf.structure_cache_size:
+                self.structures.popitem(last=False)
+        return design_graph
+
+    def run_graph(self, design_graph, eval_id, score_type=None, base_folder=None):
+        """
+        Runs the SwRI simulation of a design graph built by the caller, e.g. a topology from the arch search
+
+        Args:
+            design_graph (networkx.DiGraph): design graph with components and controls
+            eval_id (int): id of the evaluation
+            score_type (str, optional): one of ['trim', 'all'], conf.score_type if not given
+            base_folder (str, optional): folder of the eval folders, conf.base_folder if not given
+
+        Returns:
+            result (EvalResult): score vector and status of the evaluation
+        """
+        if score_type is None:
+            score_type = self.conf.score_type
+        if base_folder is None:
+            base_folder = self.conf.base_folder
+        return self._report(self._simulate(design_graph, eval_id, score_type, base_folder, time.time()))
+
+    def flush(self):
+        """
+        Waits until the background cleanup of all finished eval folders is done and writes
+        the buffered design graphs of the artifact stores
+
+        Args:
+            None
 
         Returns:
             None
         """
+        self.janitor.flush()
+        for store in self.stores.values():
+            store.flush()
+
+    def _save_design_graph(self, design_graph, eval_id, eval_folder, base_folder):
+        # one pickle per eval folder, or the run's artifact store if conf.artifact_store
+        if not self.conf.artifact_store:
+            with open(os.path.join(eval_folder, "design_graph.pk"), "wb") as fout:
+                pk.dump(design_graph, fout)
+            return
+        if base_folder not in self.stores:
+            self.stores[base_folder] = ArtifactStore(os.path.join(base_folder, 'artifacts', self.conf.artifact_run), self.worker_id)
+        self.stores[base_folder].put(eval_id, design_graph)
+
+    def _report(self, result):
+        # memory and descriptors of the worker, the head or the broker recycles workers above conf.max_worker_rss_mb
+        result.info.update(process_usage())
+        return result
+
+    def _set_error_score(self, score_type):
+        if score_type == 'trim':
+            self.score = failure_score(self.conf.trim_score)
+        else:
+            self.score = list(PATH_ERROR_SCORE)
+
+    def _simulate(self, design_graph, eval_id, score_type, base_folder, start):
+        """
+        Simulates a design graph and scores the responses
+
+        Args:
+            design_graph (networkx.DiGraph): design graph to simulate
+            eval_id (int): id of the evaluation
+            score_type (str): one of ['trim', 'all']
+            base_folder (str): folder of the eval folders
+            start (float): start time of the evaluation
+
+        Returns:
+            result (EvalResult): score vector and status of the evaluation
+        """
+        if score_type == 'all' and self.conf.parallel_paths:
+            return self._simulate_parallel(design_graph, eval_id, base_folder, start)
+
         # reset score before sim
         self.score = []
-        self.eval_done = False
-
-        selected_vector = []
-        for key in raw_work:
-            if isinstance(raw_work[key], np.ndarray):
-                selected_vector.extend(list(raw_work[key]))
-            elif key == 'eval_id':
-                continue
-            # elif key == 'discrete_baseline':
-            #     selected_vector = [*(raw_work[key]), *selected_vector]
-            elif key == 'trim_discrete_baseline':
-                selected_vector.extend(raw_work[key])
-            elif key == 'lat_vel' or key == 'vert_vel':
-                selected_vector.extend(raw_work[key])
-            else:
-                selected_vector.append(raw_work[key])
+        status = 'ok'
 
         try:
-            callback = self.mapping[self.conf.vehicle]
-            space = DesignSpace(self.conf.acel_path)
-            design_graph = callback(space, selected_vector, is_selected=True)
-            simulation = Simulation(eval_id=raw_work['eval_id'],
-                                    base_folder=self.conf.base_folder,
+            simulation = Simulation(eval_id=eval_id,
+                                    base_folder=self.janitor.eval_root(base_folder),
                                     create_folder=True)
-            manager = Manager()
-            responses = manager.dict()
-            run_path = (self.conf.score_type == 'all')
-            process = Process(target=simulation.evaluate_design,
-                              args=(design_graph, True, True, [], True, run_path, responses))
-            process.start()
-            process.join()
+            run_path = (score_type == 'all')
+            finished, responses = run_simulation(simulation, (design_graph, True, True, [], True, run_path),
+                                                 self.conf.eval_timeout, self.sim_child)
 
             # extracting score from responses
-            # get from conf.score_type, this should be TODO from head.
+            # get from score_type, set by the head per evaluation or from conf.score_type.
 
-            if not bool(responses) and not (self.conf.score_type == 'trim'):
+            if not finished:
+                # hung simulation, killed with its process tree
+                status = 'timeout'
+                if score_type == 'trim':
+                    self.score = failure_score(self.conf.trim_score, TIMEOUT)
+                else:
+                    self.score = [-999.0, -999.0, -999.0, -999.0]
+            elif not bool(responses) and not (score_type == 'trim'):
+                status = 'no_trim'
                 self.score = [0.0, 0.0, 0.0, 0.0]
             else:
-                if self.conf.score_type == 'trim':
+                if not bool(responses):
+                    status = 'no_trim'
+                if score_type == 'trim':
                     self._get_trim_score(responses)
                 else:
+                    self.score_keys = list(responses.keys())
                     for key in responses:
                         self.score.append(responses[key]['score'])
 
-            output_path = os.path.join(simulation.eval_folder, "design_graph.pk")
-            with open(output_path, "wb") as fout:
-                pk.dump(design_graph, fout)
+            self._save_design_graph(design_graph, eval_id, simulation.eval_folder, base_folder)
 
-            shutil.rmtree(os.path.join(simulation.eval_folder, "assembly/"))
+            # a killed simulation may not have written its assembly yet, the janitor ignores missing folders
+            self.janitor.finish(simulation.eval_folder, base_folder)
         except Exception as e:
             print(e)
-            if self.conf.score_type == 'trim':
-                self.score = 8 * [99999.]
-            else:
-                self.score = [-1000.0, -1000.0, -1000.0, -1000.0]
-        self.eval_done = True
+            status = 'error'
+            self._set_error_score(score_type)
+        return EvalResult(eval_id, self.worker_id, self.score, status, time.time() - start)
+
+    def _simulate_path(self, design_graph, path, eval_id, base_folder):
+        # runs in a thread of path_threads, every path has its own child and eval folder
+        path_graph = design_graph.copy()
+        for other in PATHS:
+            if other != path:
+                path_graph.graph.pop(other, None)
+        path_folder = os.path.join(base_folder, path)
+        simulation = Simulation(eval_id=eval_id,
+                                base_folder=self.janitor.eval_root(path_folder),
+                                create_folder=True)
+        finished, responses = run_simulation(simulation, (path_graph, True, True, [], True, True),
+                                             self.conf.eval_timeout, self.path_children[path])
+        # the caller hands the folder to the janitor once the design graph is saved
+        return simulation.eval_folder, path_folder, finished, responses
 
-    def collect(self):
+    def _simulate_parallel(self, design_graph, eval_id, base_folder, start):
         """
-        Collect function, called when lap time is requested
-        Resets worker instance after called
+        Simulates every path of a design graph in its own child process at the same time and
+        aggregates the path scores, every child runs the trim of the design before its path
+
         Args:
-            None
+            design_graph (networkx.DiGraph): design graph to simulate
+            eval_id (int): id of the evaluation
+            base_folder (str): folder of the per path eval folders
+            start (float): start time of the evaluation
+
         Returns:
-            curr_laptime (float): score/laptime of the current rollout
+            result (EvalResult): path scores in the order of design_vector.PATHS, of the paths in design_graph
         """
-        while not self.eval_done:
-            continue
-        return self.score
+        self.score = []
+        self.score_keys = []
+        status = 'ok'
+        paths = [path for path in PATHS if path in design_graph.graph]
+        if not paths:
+            # nothing to simulate, scored like a design without trim
+            self.score = [0.0, 0.0, 0.0, 0.0]
+            return EvalResult(eval_id, self.worker_id, self.score, 'no_trim', time.time() - start)
+        futures = [self.path_threads.submit(self._simulate_path, design_graph, path, eval_id, base_folder) for path in paths]
+        # wait for every path, so that the folders of the finished ones are cleaned up if one fails
+        runs = []
+        failure = None
+        for future in futures:
+            try:
+                runs.append(future.result())
+            except Exception as e:
+                failure = e
+        try:
+            if failure is not None:
+                raise failure
+            self._save_design_graph(design_graph, eval_id, runs[0][0], base_folder)
+
+            if not all([finished for _, _, finished, _ in runs]):
+                # a hung path fails the whole evaluation, as in a sequential run
+                status = 'timeout'
+                self.score = [-999.0, -999.0, -999.0, -999.0]
+            elif not any([bool(responses) for _, _, _, responses in runs]):
+                status = 'no_trim'
+                self.score = [0.0, 0.0, 0.0, 0.0]
+            else:
+                for path, (_, _, _, responses) in zip(paths, runs):
+                    self.score_keys.append(path)
+                    self.score.append(sum([responses[key]['score'] for key in responses]))
+        except Exception as e:
+            print(e)
+            status = 'error'
+            self._set_error_score('all')
+        finally:
+            # a killed simulation may not have written its assembly yet, the janitor ignores missing folders
+            for eval_folder, path_folder, _, _ in runs:
+                self.janitor.finish(eval_folder, path_folder)
+        return EvalResult(eval_id, self.worker_id, self.score, status, time.time() - start)
@@ -3,6 +3,7 @@ import numpy as np
 import os
 import sys
 import shutil
+import time
 from itertools import cycle
 
 from quadspider import construct_baseline_quad_spider_design
@@ -18,6 +19,9 @@ from multiprocessing import Process
 from multiprocessing import Manager
 import pickle as pk
 
+from eval_result import EvalResult
+from trim_scores import score_trims, failure_score
+
 @ray.remote
 class QuadWorker:
     """
@@ -29,7 +33,6 @@ class QuadWorker:
         # self.max_distance = 0.0
         # self.max_hover_time = 0.0
         self.score = []
-        self.eval_done = False
 
         self.conf = conf
         self.worker_id = worker_id
@@ -56,31 +59,7 @@ class QuadWorker:
         Returns:
             None
         """
-        # if response is empty, trim is not found
-        if not bool(responses):
-            self.score = 4 * [99999.]
-            return
-
-        # forward trim
-        forward_df = responses['forward']
-        forward_dist_obj = (2000.0 - forward_df['Distance'].max())
-        forward_time_obj = (410.0 - forward_df['Flight time'].max())
-        forward_frac_obj = 500.0 * (forward_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
-
-        # turn radius 500 trim
-        turn_500_df = responses['turn_500']
-        turn_500_dist_obj = (3142.0 - turn_500_df['Distance'].max())
-        turn_500_frac_obj = 500.0 * (turn_500_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
-
-        # turn radius 300 trim
-        turn_300_df = responses['turn_300']
-        turn_300_dist_obj = (3500.0 - turn_300_df['Distance'].max())
-        turn_300_speed_obj = -300 * turn_300_df['Speed'].max()
-        turn_300_frac_obj = 500.0 * (turn_300_df[['Frac pow', 'Frac amp', 'Frac current']] >= 1.0).sum().sum()
-        self.score = [forward_frac_obj, turn_500_frac_obj, turn_300_frac_obj, turn_300_speed_obj]
-        #self.score = [forward_dist_obj, forward_time_obj, forward_frac_obj, turn_500_dist_obj, turn_500_frac_obj, turn_300_dist_obj, turn_300_speed_obj, turn_300_frac_obj]
-        if np.any(np.isnan(self.score)):
-            self.score = 4 * [99999.]
+        self.score = score_trims('frac_speed', responses)
 
     def run_sim(self, raw_work):
         """
@@ -90,11 +69,12 @@ class QuadWorker:
             raw_work (numpy.ndarray (N, )): sampled current candidate, size dependends on vehicle
 
         Returns:
-            None
+            result (EvalResult): score vector and status of the evaluation
         """
         # reset score before sim
         self.score = []
-        self.eval_done = False
+        status = 'ok'
+        start = time.time()
 
         selected_vector = []
         if self.conf.use_existing:
@@ -169,6 +149,8 @@ class QuadWorker:
             process.start()
             process.join()
 
+            if not bool(responses):
+                status = 'no_trim'
             if not bool(responses) and not self.conf.trim_only and not self.conf.trim_discrete_only and not self.conf.trim_arm_only:
                 self.score = [0.0, 0.0, 0.0, 0.0]
             else:
@@ -184,21 +166,9 @@ class QuadWorker:
             shutil.rmtree(os.path.join(simulation.eval_folder, "assembly/"))
         except Exception as e:
             print(e)
+            status = 'error'
             if self.conf.trim_only or self.conf.trim_discrete_only or self.conf.trim_arm_only:
-                self.score = 8 * [99999.]
+                self.score = failure_score('frac_speed')
             else:
                 self.score = [-1000.0, -1000.0, -1000.0, -1000.0]
-        self.eval_done = True
-
-    def collect(self):
-        """
-        Collect function, called when lap time is requested
-        Resets worker instance after called
-        Args:
-            None
-        Returns:
-            curr_laptime (float): score/laptime of the current rollout
-        """
-        while not self.eval_done:
-            continue
-        return self.score
+        return EvalResult(raw_work['eval_id'], self.worker_id, self.score, status, time.time() - start)
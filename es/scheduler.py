@@ -0,0 +1,460 @@
+import ray
+import time
+import numpy as np
+from tqdm import tqdm
+
+from worker_health import worn_out
+
+
+class ScheduledRun:
+    """
+    Callbacks and bookkeeping of one optimizer run scheduled on the worker pool
+
+    Args:
+        name (str): name of the run, used for logging
+        ask (callable() -> candidate): asks the optimizer for a new candidate
+        submit (callable(worker, candidate) -> ray.ObjectRef): dispatches candidate on worker
+        tell (callable(candidate, result) -> float): tells the optimizer the result of candidate, returns the loss
+        budget (int): total number of evaluations of the run
+        checkpoint (callable(), optional): called periodically to save progress
+        lookup (callable(candidate) -> result, optional): returns a known result of candidate
+            without simulating it (e.g. from a cache), None if it has to be simulated
+        submit_copy (callable(worker, candidate) -> ray.ObjectRef, optional): dispatches a
+            speculative copy of candidate on worker, the run is not speculated on if None
+    """
+    def __init__(self, name, ask, submit, tell, budget, checkpoint=None, lookup=None, submit_copy=None):
+        self.name = name
+        self.ask = ask
+        self.submit = submit
+        self.tell = tell
+        self.budget = budget
+        self.checkpoint = checkpoint
+        self.lookup = lookup
+        self.submit_copy = submit_copy
+
+        self.num_asked = 0
+        self.num_told = 0
+        self.num_in_flight = 0
+        # candidates being evaluated, by object id
+        self.in_flight = {}
+        # candidates already asked (e.g. restored from a checkpoint) that are dispatched before asking new ones
+        self.pending = []
+        # best loss so far after each tell
+        self.best_history = []
+
+    def has_work(self):
+        """
+        Whether the run still has candidates to dispatch
+
+        Args:
+            None
+
+        Returns:
+            has_work (bool): True if there are pending candidates or budget left to ask
+        """
+        return bool(self.pending) or self.num_asked < self.budget
+
+    def record(self, cand, loss):
+        """
+        Records the loss of a finished evaluation
+
+        Args:
+            cand: finished candidate
+            loss (float): loss told to the optimizer
+
+        Returns:
+            None
+        """
+        self.num_told += 1
+        self.num_in_flight -= 1
+        self.in_flight.pop(id(cand), None)
+        if loss is None:
+            loss = np.inf
+        if self.best_history:
+            loss = min(loss, self.best_history[-1])
+        self.best_history.append(loss)
+
+    def improvement_rate(self, window):
+        """
+        Decrease of the best loss so far per evaluation over the last window evaluations
+
+        Args:
+            window (int): number of evaluations to look back
+
+        Returns:
+            rate (float): non-negative improvement rate, inf if the run has too few evaluations
+        """
+        if len(self.best_history) < 2 or not np.isfinite(self.best_history[-1]):
+            return np.inf
+        start = max(0, len(self.best_history) - 1 - window)
+        past = self.best_history[start]
+        if not np.isfinite(past):
+            return np.inf
+        return max(past - self.best_history[-1], 0.0) / (len(self.best_history) - 1 - start)
+
+
+class Scheduler:
+    """
+    Distributes candidates from one or several optimizers onto a pool of Ray workers
+
+    Two modes are available, selected with the 'scheduler' key in the config:
+        batch: ask one candidate per worker, wait for the whole batch, then tell all results
+        async: steady-state ask/tell, each result is told as soon as it arrives and the
+               free worker immediately gets a new candidate
+    Both modes ask and tell exactly budget candidates per run.
+
+    Each worker can be given several evaluations at once (evals_per_worker), they are
+    queued on the actor and run back to back without waiting for the head.
+
+    When several runs share the pool (portfolio), worker slots are reallocated towards the
+    runs whose best-so-far improves fastest over the last window evaluations, every run
+    with budget left keeps at least min_share of the slots.
+
+    With speculative, slots left idle at the end of a batch (or once no run has budget
+    left to ask) get copies of the candidates still being evaluated. The first copy of a
+    candidate to finish is told, the results of the other copies are dropped. In batch
+    mode, copies still running when their batch is told keep their slots in the next batch.
+
+    With recycle, a worker is replaced by a fresh actor after recycle_after evaluations or
+    once its resident memory exceeds max_rss_mb. It gets no new candidates until its queued
+    evaluations have finished, so no in-flight work is lost.
+    """
+    def __init__(self, workers, mode='batch', evals_per_worker=1, window=50, min_share=0.1, speculative=False,
+                 recycle=None, recycle_after=None, max_rss_mb=None):
+        if mode not in ['batch', 'async']:
+            raise ValueError('Unknown scheduler mode: ' + str(mode))
+        self.workers = workers
+        self.mode = mode
+        # one slot per evaluation that can be in flight
+        self.slots = [worker for worker in workers for _ in range(evals_per_worker)]
+        self.window = window
+        self.min_share = min_share
+        self.speculative = speculative
+
+        # callable(worker) -> new worker, e.g. WorkerPool.replace
+        self.recycle = recycle
+        self.recycle_after = recycle_after
+        self.max_rss_mb = max_rss_mb
+        # evaluations per worker since it was started
+        self.num_evals = {}
+        # workers waiting for their queued evaluations before being replaced
+        self.retiring = []
+
+    def run(self, ask, submit, tell, budget, checkpoint=None, checkpoint_every=10, submit_copy=None):
+        """
+        Runs the ask/dispatch/tell loop of a single optimizer until the budget is used up
+
+        Args:
+            ask (callable() -> candidate): asks the optimizer for a new candidate
+            submit (callable(worker, candidate) -> ray.ObjectRef): dispatches candidate on worker
+            tell (callable(candidate, result) -> float): tells the optimizer the result of candidate
+            budget (int): total number of evaluations
+            checkpoint (callable(), optional): called periodically to save progress
+            checkpoint_every (int): number of rounds over all slots between checkpoints
+            submit_copy (callable(worker, candidate) -> ray.ObjectRef, optional): dispatches a speculative copy of candidate
+
+        Returns:
+            None
+        """
+        self.run_portfolio([ScheduledRun('optim', ask, submit, tell, budget, checkpoint, submit_copy=submit_copy)],
+                           checkpoint_every)
+
+    def run_portfolio(self, runs, checkpoint_every=10):
+        """
+        Runs several optimizers concurrently on the shared worker pool until all budgets are used up
+
+        Args:
+            runs (list[ScheduledRun]): runs to schedule
+            checkpoint_every (int): number of rounds over all slots between checkpoints of a run
+
+        Returns:
+            None
+        """
+        self.checkpoint_every = checkpoint_every
+        self.pbar = tqdm(total=sum([run.budget for run in runs]), initial=sum([run.num_told for run in runs]))
+        if self.mode == 'batch':
+            self._run_batch(runs)
+        else:
+            self._run_async(runs)
+        self.pbar.close()
+
+    def _allocate(self, runs, num_slots):
+        """
+        Target number of slots for every run that still has candidates to ask
+
+        Args:
+            runs (list[ScheduledRun]): all runs
+            num_slots (int): number of slots to share
+
+        Returns:
+            targets (dict{ScheduledRun: float}): target number of slots of each active run
+        """
+        active = [run for run in runs if run.has_work()]
+        if not active:
+            return {}
+        rates = np.array([run.improvement_rate(self.window) for run in active])
+
+        # runs without enough history or without any improvement get an equal share
+        if np.any(np.isinf(rates)) or np.sum(rates) <= 0.0:
+            shares = np.ones(len(active)) / len(active)
+        else:
+            floor = min(self.min_share, 1.0 / len(active))
+            shares = floor + (1.0 - floor * len(active)) * rates / np.sum(rates)
+        return {run: share * num_slots for run, share in zip(active, shares)}
+
+    def _pick_run(self, runs, num_slots):
+        """
+        Picks the run that is furthest below its target number of slots
+
+        Args:
+            runs (list[ScheduledRun]): all runs
+            num_slots (int): number of slots in the pool
+
+        Returns:
+            run (ScheduledRun): run to ask the next candidate from, None if no budget is left
+        """
+        targets = self._allocate(runs, num_slots)
+        if not targets:
+            return None
+        return max(targets, key=lambda run: targets[run] - run.num_in_flight)
+
+    def _dispatch(self, run, worker):
+        """
+        Asks run for candidates until one has to be simulated, results found by
+        run.lookup are told right away without using the worker
+
+        Args:
+            run (ScheduledRun): run to ask candidates from
+            worker (ray.actor.ActorHandle): worker for the candidate to simulate
+
+        Returns:
+            future (ray.ObjectRef): result of the dispatched candidate, None if the run used up its budget
+            cand: dispatched candidate, None if the run used up its budget
+        """
+        while run.has_work():
+            if run.pending:
+                cand = run.pending.pop(0)
+            else:
+                cand = run.ask()
+                run.num_asked += 1
+            run.num_in_flight += 1
+            run.in_flight[id(cand)] = cand
+            result = None
+            if run.lookup is not None:
+                result = run.lookup(cand)
+            if result is None:
+                return run.submit(worker, cand), cand
+            self._tell(run, cand, result)
+        return None, None
+
+    def _tell(self, run, cand, result):
+        run.record(cand, run.tell(cand, result))
+        self.pbar.update(1)
+        if run.checkpoint is not None and run.num_told % (self.checkpoint_every * len(self.slots)) == 0:
+            run.checkpoint()
+
+    def _speculate(self, free_workers, in_flight, finished):
+        """
+        Launches a copy of the oldest stragglers on the free workers, at most one copy per
+        candidate and never on the worker already evaluating it
+
+        Args:
+            free_workers (list[ray.actor.ActorHandle]): idle slots, used slots are removed
+            in_flight (dict{ray.ObjectRef: tuple}): worker, run and candidate of every future
+            finished (set[int]): ids of candidates whose result already arrived
+
+        Returns:
+            None
+        """
+        # futures are in dispatch order, oldest first
+        copies = {}
+        for worker, run, cand in in_flight.values():
+            copies.setdefault(id(cand), (run, cand, []))[2].append(worker)
+        for run, cand, busy in copies.values():
+            if len(busy) > 1 or id(cand) in finished or run.submit_copy is None:
+                continue
+            candidates = [worker for worker in free_workers if worker not in busy]
+            if not candidates:
+                continue
+            worker = candidates[0]
+            free_workers.remove(worker)
+            in_flight[run.submit_copy(worker, cand)] = (worker, run, cand)
+
+    def _collect(self, future, in_flight, free_workers, finished):
+        """
+        Handles a finished future and frees its worker
+
+        Args:
+            future (ray.ObjectRef): finished future
+            in_flight (dict{ray.ObjectRef: tuple}): worker, run and candidate of every future
+            free_workers (list[ray.actor.ActorHandle]): idle slots
+            finished (set[int]): ids of candidates whose result already arrived
+
+        Returns:
+            done (tuple): run, candidate and result, None if another copy of the candidate finished first
+        """
+        worker, run, cand = in_flight.pop(future)
+        others = [other for other, (_, _, c) in in_flight.items() if c is cand]
+        if id(cand) in finished:
+            if not others:
+                finished.discard(id(cand))
+            self._release(worker, {}, in_flight, free_workers)
+            return None
+
+        result = ray.get(future)
+        self._release(worker, result.info, in_flight, free_workers)
+        if others:
+            # cancelling queued actor tasks breaks the actor's task ordering,
+            # the other copies are left to finish and their results are dropped
+            finished.add(id(cand))
+        return run, cand, result
+
+    def _release(self, worker, info, in_flight, free_workers):
+        """
+        Frees the slot of a worker after one of its evaluations finished, replaces the worker
+        once it is worn out and idle
+
+        Args:
+            worker (ray.actor.ActorHandle): worker of the finished evaluation
+            info (dict): info of the result, with the memory use reported by the worker
+            in_flight (dict{ray.ObjectRef: tuple}): worker, run and candidate of every future
+            free_workers (list[ray.actor.ActorHandle]): idle slots
+
+        Returns:
+            None
+        """
+        if self.recycle is None:
+            free_workers.append(worker)
+            return
+        self.num_evals[worker] = self.num_evals.get(worker, 0) + 1
+        if not any([w is worker for w in self.retiring]) and worn_out(self.num_evals[worker], info, self.recycle_after, self.max_rss_mb):
+            self.retiring.append(worker)
+            free_workers[:] = [w for w in free_workers if w is not worker]
+        if not any([w is worker for w in self.retiring]):
+            free_workers.append(worker)
+            return
+        if any([w is worker for w, _, _ in in_flight.values()]):
+            # queued evaluations of the worker finish first
+            return
+
+        new_worker = self.recycle(worker)
+        self.retiring = [w for w in self.retiring if w is not worker]
+        self.num_evals.pop(worker, None)
+        num_slots = len([w for w in self.slots if w is worker])
+        self.slots = [new_worker if w is worker else w for w in self.slots]
+        self.workers = [new_worker if w is worker else w for w in self.workers]
+        free_workers.extend(num_slots * [new_worker])
+
+    def _run_batch(self, runs):
+        num_slots = len(self.slots)
+        free_workers = list(self.slots)
+        # future -> (worker, run, candidate), losing copies and stragglers of a batch stay
+        # in flight into the next one and keep their slots until they finish
+        in_flight = {}
+        finished = set()
+        while any([run.has_work() for run in runs]):
+            # distribute, the free slots are split across runs for this batch
+            batch = []
+            while free_workers:
+                run = self._pick_run(runs, num_slots)
+                if run is None:
+                    break
+                future, cand = self._dispatch(run, free_workers[0])
+                if future is not None:
+                    in_flight[future] = (free_workers.pop(0), run, cand)
+                    batch.append((run, cand))
+
+            if not batch and in_flight:
+                # every slot is busy with a leftover of the previous batch
+                ready, _ = ray.wait(list(in_flight.keys()), num_returns=1)
+                for future in ready:
+                    self._collect(future, in_flight, free_workers, finished)
+                continue
+
+            # collect and update optimization
+            results = {}
+            while len(results) < len(batch):
+                if self.speculative:
+                    self._speculate(free_workers, in_flight, finished)
+                ready, _ = ray.wait(list(in_flight.keys()), num_returns=1)
+                for future in ready:
+                    done = self._collect(future, in_flight, free_workers, finished)
+                    if done is not None:
+                        results[id(done[1])] = done[2]
+            for run, cand in batch:
+                self._tell(run, cand, results[id(cand)])
+
+    def _run_async(self, runs):
+        num_slots = len(self.slots)
+        free_workers = list(self.slots)
+        # future -> (worker, run, candidate)
+        in_flight = {}
+        finished = set()
+        while any([run.num_told < run.budget for run in runs]):
+            # keep every free worker busy while budget remains
+            while free_workers:
+                run = self._pick_run(runs, num_slots)
+                if run is None:
+                    break
+                future, cand = self._dispatch(run, free_workers[-1])
+                if future is not None:
+                    in_flight[future] = (free_workers.pop(), run, cand)
+
+            # workers still free have nothing left to ask
+            if self.speculative:
+                self._speculate(free_workers, in_flight, finished)
+
+            if not in_flight:
+                # nothing to wait for and no run can ask, e.g. after an ask that raised
+                print('Scheduler stopped with ' + str(sum([run.budget - run.num_told for run in runs])) +
+                      ' evaluations owed and none in flight')
+                break
+            ready, _ = ray.wait(list(in_flight.keys()), num_returns=1)
+            for future in ready:
+                done = self._collect(future, in_flight, free_workers, finished)
+                if done is not None:
+                    self._tell(*done)
+
+
+def run_with_broker(broker, client, ask, submit, tell, budget, max_workers, poll=1.0):
+    """
+    Steady-state ask/tell loop on workers borrowed from a WorkerBroker, every worker is
+    given back after each evaluation so idle workers move between loops sharing the broker
+
+    Args:
+        broker (ray.actor.ActorHandle): WorkerBroker of the shared pool
+        client (int): id of this loop at the broker
+        ask (callable() -> candidate): asks the optimizer for a new candidate
+        submit (callable(worker, candidate) -> ray.ObjectRef): dispatches candidate on worker
+        tell (callable(candidate, result)): tells the optimizer the result of candidate
+        budget (int): total number of evaluations
+        max_workers (int): maximum number of workers borrowed at once
+        poll (float): seconds between requests while no worker is available
+
+    Returns:
+        None
+    """
+    # future -> (worker, candidate)
+    in_flight = {}
+    num_asked = 0
+    num_told = 0
+    while num_told < budget:
+        wanted = min(max_workers - len(in_flight), budget - num_asked)
+        if wanted > 0:
+            for worker in ray.get(broker.acquire.remote(client, wanted)):
+                cand = ask()
+                num_asked += 1
+                in_flight[submit(worker, cand)] = (worker, cand)
+
+        if not in_flight:
+            time.sleep(poll)
+            continue
+        ready, _ = ray.wait(list(in_flight.keys()), num_returns=1, timeout=poll)
+        for future in ready:
+            worker, cand = in_flight.pop(future)
+            result = ray.get(future)
+            # the broker replaces the worker instead of lending it again once it is worn out
+            broker.release.remote(client, [worker], [result.info])
+            tell(cand, result)
+            num_told += 1
+    ray.get(broker.leave.remote(client))
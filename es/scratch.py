@@ -0,0 +1,89 @@
+import os
+import queue
+import shutil
+import threading
+
+
+class Janitor:
+    """
+    Cleans up eval folders in a background thread, off the critical path of the worker
+
+    With a scratch root (e.g. /dev/shm), simulations write their eval folders on node local
+    scratch and the janitor moves the kept artifacts to the persistent base folder before
+    deleting the scratch folder. Without one, eval folders are written to the base folder
+    as before and the janitor only deletes the discarded entries.
+    """
+    def __init__(self, scratch_root=None, discard=('assembly', ), max_pending=64):
+        self.scratch_root = scratch_root
+        self.discard = set(discard)
+        self.created = set()
+        # bounded, a worker waits if cleanup falls behind instead of filling the scratch disk
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def eval_root(self, base_folder):
+        """
+        Folder in which the simulation creates its eval folder
+
+        Args:
+            base_folder (str): persistent folder of the eval folders
+
+        Returns:
+            root (str): mirror of base_folder under the scratch root, base_folder without one
+        """
+        if self.scratch_root is None:
+            return base_folder
+        root = os.path.join(self.scratch_root, os.path.abspath(base_folder).lstrip(os.sep))
+        if root not in self.created:
+            os.makedirs(root, exist_ok=True)
+            self.created.add(root)
+        return root
+
+    def finish(self, eval_folder, base_folder):
+        """
+        Queues a finished eval folder for cleanup
+
+        Args:
+            eval_folder (str): eval folder created under eval_root(base_folder)
+            base_folder (str): persistent folder of the eval folders
+
+        Returns:
+            None
+        """
+        self.pending.put((eval_folder, base_folder))
+
+    def flush(self):
+        """
+        Waits until all queued eval folders are cleaned up
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.pending.join()
+
+    def _loop(self):
+        while True:
+            eval_folder, base_folder = self.pending.get()
+            try:
+                self._clean(eval_folder, base_folder)
+            except Exception as e:
+                print(e)
+            finally:
+                self.pending.task_done()
+
+    def _clean(self, eval_folder, base_folder):
+        if self.scratch_root is None:
+            for name in self.discard:
+                shutil.rmtree(os.path.join(eval_folder, name), ignore_errors=True)
+            return
+
+        target = os.path.join(base_folder, os.path.relpath(eval_folder, self.eval_root(base_folder)))
+        os.makedirs(target, exist_ok=True)
+        for name in os.listdir(eval_folder):
+            if name not in self.discard:
+                shutil.move(os.path.join(eval_folder, name), os.path.join(target, name))
+        shutil.rmtree(eval_folder, ignore_errors=True)
@@ -0,0 +1,191 @@
+import os
+import atexit
+import signal
+import importlib
+import traceback
+import multiprocessing
+from multiprocessing import Process, Manager
+
+from sim_responses import compact_responses
+
+# modules imported once by the forkserver of the long lived simulation children
+SIM_PRELOAD = ['sim_process', 'uav_simulator.simulation']
+
+
+def _run_in_new_session(target, args):
+    # own process group, so the whole tree (FDM binary, FreeCAD) can be killed at once
+    os.setsid()
+    target(*args)
+
+
+def kill_process_tree(pid):
+    """
+    Kills a child started by run_process together with all processes it spawned
+
+    Args:
+        pid (int): pid of the child, also the id of its process group
+
+    Returns:
+        None
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_process(target, args, timeout=None):
+    """
+    Runs target(*args) in a child process and waits for it
+
+    Args:
+        target (callable): function to run in the child
+        args (tuple): arguments of target
+        timeout (float, optional): wall clock limit in seconds, no limit if None
+
+    Returns:
+        finished (bool): False if the child was killed after timeout seconds
+    """
+    process = Process(target=_run_in_new_session, args=(target, args))
+    process.start()
+    process.join(timeout)
+    if process.is_alive():
+        kill_process_tree(process.pid)
+        process.join()
+        return False
+    return True
+
+
+def _evaluate_compact(target, args, responses):
+    # fills the Manager dict of a one-off child once, with the compact responses
+    local = {}
+    try:
+        target(*args, local)
+    finally:
+        responses.update(compact_responses(local))
+
+
+def _serve(conn, preload):
+    # long lived child, modules of the simulator stack are imported once
+    os.setsid()
+    for name in preload:
+        importlib.import_module(name)
+    while True:
+        try:
+            target, args = conn.recv()
+        except EOFError:
+            # the worker is gone
+            return
+        responses = {}
+        try:
+            target(*args, responses)
+        except Exception:
+            # same as a failed one-off child, the responses filled so far are kept
+            traceback.print_exc()
+        conn.send(compact_responses(responses))
+
+
+class SimulationChild:
+    """
+    Long lived child process of a worker that runs simulations sent over a pipe
+
+    The child is forked from a forkserver with the preload modules already imported, so
+    starting it again is cheap. It is started again after max_evals evaluations, after
+    a crash and after a timeout.
+    """
+    def __init__(self, preload=(), max_evals=100):
+        self.preload = list(preload)
+        self.max_evals = max_evals
+        self.ctx = multiprocessing.get_context('forkserver')
+        self.ctx.set_forkserver_preload(self.preload)
+        self.process = None
+        self.conn = None
+        self.num_evals = 0
+        # runs before multiprocessing joins its children at exit, which would wait on the idle child forever
+        atexit.register(self.stop)
+
+    def _start(self):
+        self.conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=_serve, args=(child_conn, self.preload))
+        self.process.start()
+        child_conn.close()
+        self.num_evals = 0
+
+    def stop(self):
+        """
+        Kills the child together with all processes it spawned
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self.process is None:
+            return
+        self.conn.close()
+        kill_process_tree(self.process.pid)
+        self.process.join()
+        self.process = None
+        self.conn = None
+
+    def run(self, target, args, timeout=None):
+        """
+        Runs target(*args, responses) in the child and waits for it, target fills the dict responses
+
+        Args:
+            target (callable): picklable function to run in the child
+            args (tuple): picklable arguments of target, without responses
+            timeout (float, optional): wall clock limit in seconds, no limit if None
+
+        Returns:
+            finished (bool): False if the child was killed after timeout seconds
+            responses (dict): compact responses filled by target, empty if it timed out
+        """
+        if self.process is None or not self.process.is_alive():
+            self.stop()
+            self._start()
+
+        self.conn.send((target, args))
+        if not self.conn.poll(timeout):
+            self.stop()
+            return False, {}
+        try:
+            responses = self.conn.recv()
+        except EOFError:
+            self.process.join()
+            exitcode = self.process.exitcode
+            self.stop()
+            raise RuntimeError('Simulation child crashed with exit code ' + str(exitcode))
+
+        self.num_evals += 1
+        if self.num_evals >= self.max_evals:
+            self.stop()
+        return True, responses
+
+
+def run_simulation(simulation, args, timeout=None, child=None):
+    """
+    Runs simulation.evaluate_design(*args, responses) in the long lived child of the worker,
+    or in a one-off child process with a Manager dict if the worker has none
+
+    Args:
+        simulation (uav_simulator.simulation.Simulation): simulation of the evaluation
+        args (tuple): arguments of evaluate_design, without responses
+        timeout (float, optional): wall clock limit in seconds, no limit if None
+        child (SimulationChild, optional): long lived child of the worker
+
+    Returns:
+        finished (bool): False if the simulation was killed after timeout seconds
+        responses (dict): compact responses of the simulation, see sim_responses.compact_responses
+    """
+    if child is not None:
+        return child.run(simulation.evaluate_design, args, timeout)
+    manager = Manager()
+    try:
+        responses = manager.dict()
+        finished = run_process(_evaluate_compact, (simulation.evaluate_design, args, responses), timeout)
+        return finished, dict(responses)
+    finally:
+        # the manager server process and its sockets would otherwise live until garbage collection
+        manager.shutdown()
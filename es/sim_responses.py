@@ -0,0 +1,41 @@
+import numpy as np
+
+# columns of the trim tables used for scoring, every table is sent as one float array in this order
+TRIM_COLUMNS = ['Distance', 'Flight time', 'Speed', 'Frac pow', 'Frac amp', 'Frac current']
+FRAC_COLUMNS = ['Frac pow', 'Frac amp', 'Frac current']
+
+
+def _to_table(df):
+    table = np.full((len(df), len(TRIM_COLUMNS)), np.nan)
+    for i, column in enumerate(TRIM_COLUMNS):
+        if column in df.columns:
+            try:
+                table[:, i] = np.asarray(df[column], dtype=np.float64)
+            except (TypeError, ValueError):
+                pass
+    return table
+
+
+def compact_responses(responses):
+    """
+    Reduces simulation responses to what the workers score, run in the simulation child
+    so that only small arrays cross the process boundary
+
+    Args:
+        responses (dict): responses filled by evaluate_design, trim tables as pandas.DataFrame
+                          and path results as dicts with a 'score'
+
+    Returns:
+        compact (dict): trim tables as numpy.ndarray (N, len(TRIM_COLUMNS)) with nan for missing
+                        columns, path results as dicts with only the 'score', other values unchanged
+    """
+    compact = {}
+    for key, value in responses.items():
+        if hasattr(value, 'columns'):
+            compact[key] = _to_table(value)
+        elif isinstance(value, dict) and 'score' in value:
+            compact[key] = {'score': value['score']}
+        else:
+            compact[key] = value
+    return compact
+
@@ -0,0 +1,68 @@
+import os
+import hashlib
+import functools
+import pickle as pk
+import tempfile
+
+
+def _file_digest(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as fin:
+        for block in iter(lambda: fin.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def space_id(acel_path):
+    """
+    Identifier of a design space file, part of the keys of evaluations shared across runs
+
+    Args:
+        acel_path (str): path to design space file
+
+    Returns:
+        space_id (str): content hash of the file, its path if the file cannot be read on this node
+    """
+    try:
+        return _file_digest(acel_path)
+    except OSError:
+        return acel_path
+
+
+def load_design_space(acel_path, cache_dir='/tmp/tunercar_design_spaces'):
+    """
+    Loads the design space of acel_path, parsed once per node and cached as a pickle
+    keyed by the mtime and content hash of the design space file
+
+    Args:
+        acel_path (str): path to design space file
+        cache_dir (str): node local directory of the cached design spaces
+
+    Returns:
+        space (prob_design_generator.space.DesignSpace): design space, treat as read only
+    """
+    stat = os.stat(acel_path)
+    key = hashlib.sha1((os.path.abspath(acel_path) + str(stat.st_mtime) + _file_digest(acel_path)).encode()).hexdigest()
+    path = os.path.join(cache_dir, 'space_' + key + '.pk')
+    if os.path.exists(path):
+        try:
+            with open(path, 'rb') as fin:
+                return pk.load(fin)
+        except Exception as e:
+            # truncated or from another version of the design space package, parse again
+            print(e)
+
+    from prob_design_generator.space import DesignSpace
+    space = DesignSpace(acel_path)
+    try:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir, exist_ok=True)
+        # workers on the node may write at the same time, the rename is atomic
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fout:
+            pk.dump(space, fout, protocol=pk.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(e)
+    return space
@@ -0,0 +1,39 @@
+import numpy as np
+
+
+def promote(trim_losses, trimmed, fraction):
+    """
+    Candidates of a rung simulated on paths, the best trim losses among the designs that trimmed
+
+    Args:
+        trim_losses (numpy.ndarray (N, )): trim loss of every candidate of the rung
+        trimmed (list[bool]): whether the trim of every candidate was found
+        fraction (float): fraction of the rung to promote, at least one candidate
+
+    Returns:
+        promoted (list[int]): indices of the promoted candidates, best trim loss first
+    """
+    num_promoted = max(int(round(fraction * len(trim_losses))), 1)
+    return [i for i in np.argsort(trim_losses, kind='stable') if trimmed[i]][:num_promoted]
+
+
+def rung_losses(trim_losses, path_losses, worst_path_loss):
+    """
+    Losses told for a rung, candidates that were not promoted rank after every path simulated
+    design, in the order of their trim losses
+
+    Args:
+        trim_losses (numpy.ndarray (N, )): trim loss of every candidate of the rung
+        path_losses (dict{int: float}): path loss of every promoted candidate
+        worst_path_loss (float): bound of the path losses, the loss of a failed path simulation
+
+    Returns:
+        losses (numpy.ndarray (N, )): loss of every candidate
+    """
+    trim_losses = np.asarray(trim_losses, dtype=np.float64)
+    # trim losses are negative for designs that trim fast, only their distance to the best one is added
+    bound = max([worst_path_loss] + list(path_losses.values()))
+    losses = bound + 1.0 + trim_losses - np.min(trim_losses)
+    for i, loss in path_losses.items():
+        losses[i] = loss
+    return losses
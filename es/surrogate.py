@@ -0,0 +1,127 @@
+import threading
+import numpy as np
+
+try:
+    from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+    from sklearn.neighbors import KNeighborsRegressor
+except ImportError:
+    RandomForestRegressor = None
+
+
+class Surrogate:
+    """
+    Cheap model of the loss of a flat design vector, trained online on the evaluated candidates
+
+    The model is refit in a background thread every retrain_every new samples, prediction
+    always uses the last fitted model and never waits for training.
+
+    Models, selected with the 'surrogate' key in the config:
+        forest: random forest, uncertainty is the spread of the trees
+        boosting: gradient boosting, no uncertainty estimate
+        knn: k nearest neighbours, uncertainty is the spread of the neighbours
+    """
+    def __init__(self, model='forest', min_samples=50, retrain_every=20, seed=None):
+        if RandomForestRegressor is None:
+            raise ImportError('The surrogate requires scikit-learn, pip install scikit-learn')
+        if model not in ['forest', 'boosting', 'knn']:
+            raise ValueError('Unknown surrogate model: ' + str(model))
+        self.model = model
+        self.min_samples = min_samples
+        self.retrain_every = retrain_every
+        self.seed = seed
+
+        self.xs = []
+        self.ys = []
+        self.fitted = None
+        self.fitted_ys = None
+        self.num_fitted = 0
+        self.lock = threading.Lock()
+        self.new_data = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._train_loop, daemon=True)
+        self.thread.start()
+
+    def _new_model(self):
+        if self.model == 'forest':
+            return RandomForestRegressor(n_estimators=50, min_samples_leaf=2, random_state=self.seed)
+        if self.model == 'boosting':
+            return GradientBoostingRegressor(random_state=self.seed)
+        return KNeighborsRegressor(n_neighbors=5, weights='distance')
+
+    def _train_loop(self):
+        while True:
+            self.new_data.wait()
+            self.new_data.clear()
+            if self.stopped:
+                return
+            with self.lock:
+                xs = np.asarray(self.xs, dtype=np.float64)
+                ys = np.asarray(self.ys, dtype=np.float64)
+            model = self._new_model()
+            model.fit(xs, ys)
+            with self.lock:
+                self.fitted = model
+                self.fitted_ys = ys
+                self.num_fitted = len(ys)
+
+    def add(self, vector, loss):
+        """
+        Adds an evaluated candidate to the training data
+
+        Args:
+            vector (numpy.ndarray (N, )): flat design vector, see design_vector.FlatPlan
+            loss (float): loss told to the optimizer
+
+        Returns:
+            None
+        """
+        if not np.isfinite(loss):
+            return
+        with self.lock:
+            self.xs.append(np.asarray(vector, dtype=np.float64))
+            self.ys.append(float(loss))
+            num_samples = len(self.ys)
+            num_fitted = self.num_fitted
+        if num_samples >= self.min_samples and num_samples - num_fitted >= self.retrain_every:
+            self.new_data.set()
+
+    def ready(self):
+        """
+        Whether a model has been fitted yet
+
+        Args:
+            None
+
+        Returns:
+            ready (bool): True if predict can be used
+        """
+        with self.lock:
+            return self.fitted is not None
+
+    def predict(self, vectors):
+        """
+        Predicts the loss of candidates with the last fitted model
+
+        Args:
+            vectors (numpy.ndarray (N, K)): flat design vectors, see design_vector.FlatPlan.flatten_batch
+
+        Returns:
+            mean (numpy.ndarray (N, )): predicted losses
+            std (numpy.ndarray (N, )): uncertainty of the predictions, zeros for boosting
+        """
+        with self.lock:
+            model = self.fitted
+            fitted_ys = self.fitted_ys
+        xs = np.asarray(vectors, dtype=np.float64)
+        if self.model == 'forest':
+            per_tree = np.stack([tree.predict(xs) for tree in model.estimators_])
+            return per_tree.mean(axis=0), per_tree.std(axis=0)
+        if self.model == 'knn':
+            _, neighbors = model.kneighbors(xs)
+            targets = fitted_ys[neighbors]
+            return model.predict(xs), targets.std(axis=1)
+        return model.predict(xs), np.zeros(len(xs))
+
+    def close(self):
+        self.stopped = True
+        self.new_data.set()
@@ -0,0 +1,187 @@
+import numpy as np
+
+from sim_responses import TRIM_COLUMNS, FRAC_COLUMNS, compact_responses
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# trim tables read by the score functions, in the order of the trim axis of a batch
+TRIMS = ['forward', 'turn_500', 'turn_300']
+FRAC_INDICES = np.asarray([TRIM_COLUMNS.index(column) for column in FRAC_COLUMNS], dtype=np.int64)
+DISTANCE = TRIM_COLUMNS.index('Distance')
+FLIGHT_TIME = TRIM_COLUMNS.index('Flight time')
+SPEED = TRIM_COLUMNS.index('Speed')
+# every score entry of candidates without trim or with a nan objective
+NO_TRIM = 99999.
+# every score entry of candidates whose trim simulation timed out
+TIMEOUT = 99998.
+
+# name -> function of (maxes, counts) to scores (numpy.ndarray (B, K)), see score_batch
+SCORE_FUNCTIONS = {}
+
+
+def score_function(name):
+    """
+    Registers a trim score function under name, selected with the 'trim_score' key in the config
+
+    The function gets the reductions of a batch of trim tables and returns one score vector per
+    candidate, nan entries are replaced by the failure score in score_batch.
+        maxes (numpy.ndarray (B, len(TRIMS), len(TRIM_COLUMNS))): nan ignoring max of every column
+        counts (numpy.ndarray (B, len(TRIMS))): saturated entries of the FRAC_COLUMNS of every trim
+
+    Args:
+        name (str): name of the score function
+
+    Returns:
+        decorator (callable): registers and returns the decorated function
+    """
+    def decorator(fn):
+        SCORE_FUNCTIONS[name] = fn
+        return fn
+    return decorator
+
+
+@score_function('frac_speed_latvel')
+def _frac_speed_latvel(maxes, counts):
+    # overloads of every trim, speed of the 300 turn and the max lateral velocity of both turns
+    return np.stack([500.0 * counts[:, 0],
+                     500.0 * counts[:, 1],
+                     500.0 * counts[:, 2],
+                     -300 * maxes[:, 2, SPEED],
+                     np.maximum(maxes[:, 1, SPEED], maxes[:, 2, SPEED])], axis=1)
+
+
+@score_function('frac_speed')
+def _frac_speed(maxes, counts):
+    return np.stack([500.0 * counts[:, 0],
+                     500.0 * counts[:, 1],
+                     500.0 * counts[:, 2],
+                     -300 * maxes[:, 2, SPEED]], axis=1)
+
+
+@score_function('distance_time_frac')
+def _distance_time_frac(maxes, counts):
+    return np.stack([2000.0 - maxes[:, 0, DISTANCE],
+                     410.0 - maxes[:, 0, FLIGHT_TIME],
+                     500.0 * counts[:, 0],
+                     3142.0 - maxes[:, 1, DISTANCE],
+                     500.0 * counts[:, 1],
+                     3500.0 - maxes[:, 2, DISTANCE],
+                     - maxes[:, 2, SPEED],
+                     500.0 * counts[:, 2]], axis=1)
+
+
+def failure_score(name, value=NO_TRIM):
+    """
+    Score vector of a trim evaluation without scores, as long as the vectors of the score function
+
+    Args:
+        name (str): score function in SCORE_FUNCTIONS
+        value (float): every entry, NO_TRIM for errors and designs without trim, TIMEOUT for timeouts
+
+    Returns:
+        score (list[float]): score vector
+    """
+    # the length of the score vectors, from an empty batch
+    num_scores = SCORE_FUNCTIONS[name](np.zeros((0, len(TRIMS), len(TRIM_COLUMNS))), np.zeros((0, len(TRIMS)))).shape[1]
+    return num_scores * [value]
+
+
+def _reduce_loops(tables, frac_indices):
+    num_batch, num_trims, num_rows, num_columns = tables.shape
+    maxes = np.full((num_batch, num_trims, num_columns), np.nan)
+    counts = np.zeros((num_batch, num_trims))
+    for b in range(num_batch):
+        for t in range(num_trims):
+            for r in range(num_rows):
+                for c in range(num_columns):
+                    value = tables[b, t, r, c]
+                    if not np.isnan(value) and (np.isnan(maxes[b, t, c]) or value > maxes[b, t, c]):
+                        maxes[b, t, c] = value
+                for c in frac_indices:
+                    # comparisons with nan are False, as in pandas
+                    if tables[b, t, r, c] >= 1.0:
+                        counts[b, t] += 1
+    return maxes, counts
+
+
+def _reduce_numpy(tables, frac_indices):
+    valid = ~np.isnan(tables)
+    maxes = np.where(valid, tables, -np.inf).max(axis=2, initial=-np.inf)
+    maxes[~valid.any(axis=2)] = np.nan
+    counts = np.sum(tables[..., frac_indices] >= 1.0, axis=(2, 3)).astype(np.float64)
+    return maxes, counts
+
+
+# one pass over the padded tables when numba is installed, array expressions otherwise
+if numba is not None:
+    _reduce = numba.njit(cache=True)(_reduce_loops)
+else:
+    _reduce = _reduce_numpy
+
+
+def stack_trims(responses_list):
+    """
+    Stacks the trim tables of a batch of responses into one nan padded array
+
+    Args:
+        responses_list (list[dict]): responses of the candidates, compact as in sim_responses or
+                                     with pandas.DataFrame trim tables, e.g. loaded offline
+
+    Returns:
+        tables (numpy.ndarray (B, len(TRIMS), R, len(TRIM_COLUMNS))): trim tables, padded with nan to the longest table
+        found (numpy.ndarray (B, )): False for empty responses, trim not found
+    """
+    found = np.asarray([bool(responses) for responses in responses_list], dtype=bool)
+    trims = []
+    for responses in responses_list:
+        if not responses:
+            trims.append(None)
+            continue
+        if any(hasattr(responses[trim], 'columns') for trim in TRIMS):
+            responses = compact_responses({trim: responses[trim] for trim in TRIMS})
+        trims.append([responses[trim] for trim in TRIMS])
+    num_rows = max([len(table) for tables in trims if tables is not None for table in tables], default=0)
+    tables = np.full((len(responses_list), len(TRIMS), num_rows, len(TRIM_COLUMNS)), np.nan)
+    for b, batch_tables in enumerate(trims):
+        if batch_tables is None:
+            continue
+        for t, table in enumerate(batch_tables):
+            tables[b, t, :len(table)] = table
+    return tables, found
+
+
+def score_batch(name, responses_list):
+    """
+    Trim scores of a batch of responses, a single evaluation in a worker or thousands of
+    stored responses offline
+
+    Args:
+        name (str): score function in SCORE_FUNCTIONS
+        responses_list (list[dict]): responses of the candidates, see stack_trims
+
+    Returns:
+        scores (numpy.ndarray (B, K)): score vector of every candidate, all NO_TRIM
+                                       if the trim is not found or an entry is nan
+    """
+    tables, found = stack_trims(responses_list)
+    maxes, counts = _reduce(tables, FRAC_INDICES)
+    scores = np.asarray(SCORE_FUNCTIONS[name](maxes, counts), dtype=np.float64)
+    scores[~found | np.any(np.isnan(scores), axis=1)] = NO_TRIM
+    return scores
+
+
+def score_trims(name, responses):
+    """
+    Trim score of the responses of one evaluation
+
+    Args:
+        name (str): score function in SCORE_FUNCTIONS
+        responses (dict): responses of the evaluation, see stack_trims
+
+    Returns:
+        score (list[float]): score vector, see score_batch
+    """
+    return score_batch(name, [responses])[0].tolist()
@@ -0,0 +1,37 @@
+import os
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+def process_usage():
+    """
+    Resident memory and open file descriptors of the calling process, reported by the
+    workers with every result so the head can recycle leaking workers
+
+    Args:
+        None
+
+    Returns:
+        usage (dict): 'rss' in bytes and 'fds', the number of open file descriptors
+    """
+    with open('/proc/self/statm') as fin:
+        rss = int(fin.read().split()[1]) * PAGE_SIZE
+    return {'rss': rss, 'fds': len(os.listdir('/proc/self/fd'))}
+
+
+def worn_out(num_evals, usage, recycle_after=None, max_rss_mb=None):
+    """
+    Whether a long lived worker should be replaced by a fresh actor
+
+    Args:
+        num_evals (int): evaluations run by the worker since it was started
+        usage (dict): usage reported with its last result, see process_usage
+        recycle_after (int, optional): evaluations after which the worker is replaced
+        max_rss_mb (float, optional): resident memory in MB above which the worker is replaced
+
+    Returns:
+        worn_out (bool): True if the worker should be replaced
+    """
+    if recycle_after is not None and num_evals >= recycle_after:
+        return True
+    return max_rss_mb is not None and usage.get('rss', 0) > max_rss_mb * 2 ** 20
@@ -0,0 +1,213 @@
+import ray
+from ray.util.placement_group import placement_group, remove_placement_group
+from ray.util.scheduling_strategies import PlacementGroupSchedulingStrategy
+
+from worker_health import worn_out
+
+
+def get_num_workers(conf, max_workers=None):
+    """
+    Number of workers the Ray cluster can host, counted per node so that every
+    worker fits on a single node with its CPU reservation
+
+    Args:
+        conf (argparse.Namespace): experiment config, uses conf.cpus_per_eval
+        max_workers (int, optional): upper bound on the number of workers
+
+    Returns:
+        num_workers (int): number of workers for the pool
+    """
+    num_workers = 0
+    for node in ray.nodes():
+        if not node['Alive']:
+            continue
+        num_workers += int(node['Resources'].get('CPU', 0) // conf.cpus_per_eval)
+
+    # fall back to the aggregate if node info is not available
+    if num_workers == 0:
+        num_workers = int(ray.cluster_resources().get('CPU', 1) // conf.cpus_per_eval)
+
+    if max_workers is not None:
+        num_workers = min(num_workers, max_workers)
+    return max(num_workers, 1)
+
+
+class WorkerPool:
+    """
+    Pool of Ray worker actors placed across the cluster with a placement group
+
+    Every worker reserves conf.cpus_per_eval CPUs, which accounts for the simulation
+    child process (and the FDM binary it runs) that each worker forks per evaluation.
+    Bundles are placed with conf.placement_strategy, SPREAD distributes the workers
+    evenly across nodes.
+    """
+    def __init__(self, worker_cls, conf, num_workers, cpus_per_worker=None):
+        self.worker_cls = worker_cls
+        self.conf = conf
+        self.num_workers = num_workers
+        # workers that only coordinate, e.g. the meta workers of the nested search, reserve less
+        self.cpus_per_worker = conf.cpus_per_eval if cpus_per_worker is None else cpus_per_worker
+
+        bundles = [{'CPU': self.cpus_per_worker} for _ in range(num_workers)]
+        self.pg = placement_group(bundles, strategy=conf.placement_strategy)
+        ray.get(self.pg.ready())
+
+        self.workers = [self.create_worker(worker_id) for worker_id in range(num_workers)]
+
+    def create_worker(self, worker_id):
+        """
+        Starts a worker actor in the placement group bundle of worker_id
+
+        Args:
+            worker_id (int): id of the worker, also the index of its bundle
+
+        Returns:
+            worker (ray.actor.ActorHandle): handle of the new worker
+        """
+        strategy = PlacementGroupSchedulingStrategy(placement_group=self.pg,
+                                                    placement_group_bundle_index=worker_id)
+        return self.worker_cls.options(num_cpus=self.cpus_per_worker,
+                                       scheduling_strategy=strategy).remote(self.conf, worker_id)
+
+    def replace(self, worker):
+        """
+        Replaces an idle worker by a fresh actor in the same placement group bundle, e.g. to
+        free the memory a long lived worker leaked
+
+        Args:
+            worker (ray.actor.ActorHandle): worker to replace, must have no evaluations in flight
+
+        Returns:
+            new_worker (ray.actor.ActorHandle): handle of the new worker with the same worker id
+        """
+        # handles compare by actor id, also copies of the pool and its handles, e.g. in a WorkerBroker
+        worker_id = [i for i, w in enumerate(self.workers) if w == worker][0]
+        ray.get(worker.flush.remote())
+        ray.kill(worker)
+        self.workers[worker_id] = self.create_worker(worker_id)
+        return self.workers[worker_id]
+
+    def shutdown(self):
+        """
+        Waits for the background cleanup of the workers, then kills all workers and releases
+        the placement group reservation
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        ray.get([worker.flush.remote() for worker in self.workers])
+        for worker in self.workers:
+            ray.kill(worker)
+        self.workers = []
+        remove_placement_group(self.pg)
+
+
+@ray.remote(num_cpus=0)
+class WorkerBroker:
+    """
+    Lends workers of a shared pool to several ask/tell loops, e.g. the inner optimizations
+    of the meta workers in the nested arch search
+
+    Loops give every worker back after each evaluation, so idle workers go to whichever
+    loop asks next. While some loop gets fewer workers than it asked for, the others are
+    capped at an equal share of the pool.
+
+    With a pool, a worker given back after recycle_after evaluations or above max_rss_mb of
+    resident memory is replaced by a fresh actor through the pool before it is lent again.
+    Replacements are owned by the broker, get them with current_workers before shutting
+    the pool down and killing the broker.
+    """
+    def __init__(self, workers, pool=None, recycle_after=None, max_rss_mb=None):
+        self.workers = list(workers)
+        self.free = list(workers)
+        self.num_workers = len(workers)
+        # client -> number of workers held
+        self.held = {}
+        # clients that got fewer workers than they asked for
+        self.starved = set()
+
+        self.pool = pool
+        self.recycle_after = recycle_after
+        self.max_rss_mb = max_rss_mb
+        # evaluations per worker since it was started
+        self.num_evals = {}
+
+    def acquire(self, client, num):
+        """
+        Lends up to num free workers
+
+        Args:
+            client (int): id of the borrowing loop
+            num (int): number of workers wanted
+
+        Returns:
+            workers (list[ray.actor.ActorHandle]): lent workers, may be empty
+        """
+        held = self.held.get(client, 0)
+        wanted = num
+        if self.starved - {client}:
+            active = set([c for c, h in self.held.items() if h > 0]) | self.starved | {client}
+            share = -(-self.num_workers // len(active))
+            num = min(num, max(share - held, 0))
+        workers = self.free[:num]
+        del self.free[:num]
+        self.held[client] = held + len(workers)
+        if len(workers) < wanted:
+            self.starved.add(client)
+        else:
+            self.starved.discard(client)
+        return workers
+
+    def release(self, client, workers, infos=None):
+        """
+        Gives workers back to the pool
+
+        Args:
+            client (int): id of the borrowing loop
+            workers (list[ray.actor.ActorHandle]): workers to give back
+            infos (list[dict], optional): info of the last result of every worker, with the memory use it reported
+
+        Returns:
+            None
+        """
+        if infos is None:
+            infos = len(workers) * [{}]
+        for worker, info in zip(workers, infos):
+            if self.pool is not None:
+                self.num_evals[worker] = self.num_evals.get(worker, 0) + 1
+                if worn_out(self.num_evals[worker], info, self.recycle_after, self.max_rss_mb):
+                    # workers are idle once given back
+                    new_worker = self.pool.replace(worker)
+                    self.num_evals.pop(worker)
+                    self.workers = [new_worker if w == worker else w for w in self.workers]
+                    worker = new_worker
+            self.free.append(worker)
+        self.held[client] = self.held.get(client, 0) - len(workers)
+
+    def current_workers(self):
+        """
+        Handles of all workers of the pool, replacements included
+
+        Args:
+            None
+
+        Returns:
+            workers (list[ray.actor.ActorHandle]): lent and free workers
+        """
+        return self.workers
+
+    def leave(self, client):
+        """
+        Forgets a finished loop, it has to have released all its workers
+
+        Args:
+            client (int): id of the borrowing loop
+
+        Returns:
+            None
+        """
+        self.held.pop(client, None)
+        self.starved.discard(client)
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# modules of es/ import each other by their flat names, as when the experiments run from es/
+ES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'es')
+if ES_DIR not in sys.path:
+    sys.path.insert(0, ES_DIR)
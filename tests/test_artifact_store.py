@@ -0,0 +1,42 @@
+import os
+
+from artifact_store import ArtifactStore, ArtifactIndex, run_name
+
+
+def test_runs_keep_their_graphs(tmp_path):
+    base = str(tmp_path / 'artifacts')
+    trim = os.path.join(base, run_name(['iccps_runs/npzs/quad_CMA_budget100.npz']))
+    control = os.path.join(base, run_name(['iccps_runs/npzs/quad_CMA+CMA_budget100.npz']))
+    assert os.path.basename(control) == 'quad_CMA+CMA_budget100'
+    # both phases number their evals from 0
+    for root, phase in [(trim, 'trim'), (control, 'control')]:
+        for worker_id in range(2):
+            store = ArtifactStore(root, worker_id, flush_every=3)
+            for eval_id in range(worker_id, 10, 2):
+                store.put(eval_id, {'phase': phase, 'eval_id': eval_id})
+            store.flush()
+
+    for root, phase in [(trim, 'trim'), (control, 'control')]:
+        index = ArtifactIndex(root)
+        assert index.eval_ids() == list(range(10))
+        for eval_id in index.eval_ids():
+            assert index.load(eval_id) == {'phase': phase, 'eval_id': eval_id}
+
+
+def test_identical_graphs_stored_once(tmp_path):
+    store = ArtifactStore(str(tmp_path), 0)
+    assert store.put(0, {'arm': 1}) == store.put(1, {'arm': 1})
+    store.flush()
+    index = ArtifactIndex(str(tmp_path))
+    assert index.digest(0) == index.digest(1)
+    assert len(store.locations) == 1
+
+
+def test_ambiguous_eval_ids_skipped(tmp_path):
+    for worker_id, graph in enumerate([{'arm': 1}, {'arm': 2}]):
+        store = ArtifactStore(str(tmp_path), worker_id)
+        store.put(0, graph)
+        store.put(worker_id + 1, graph)
+        store.flush()
+    index = ArtifactIndex(str(tmp_path))
+    assert index.eval_ids() == [1, 2]
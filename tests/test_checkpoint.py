@@ -0,0 +1,69 @@
+import os
+
+from checkpoint import save_checkpoint, load_checkpoint, EvalLog
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'optim.ckpt')
+    assert load_checkpoint(path) is None
+    shared = {'value': [1.0, 2.0]}
+    save_checkpoint(path, {'optim': shared, 'in_flight': [shared], 'next_eval_id': 7})
+    state = load_checkpoint(path)
+    assert state['next_eval_id'] == 7
+    assert state['optim'] == shared
+    # objects referenced twice stay shared after loading
+    assert state['in_flight'][0] is state['optim']
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_checkpoint_overwrite(tmp_path):
+    path = str(tmp_path / 'optim.ckpt')
+    save_checkpoint(path, {'next_eval_id': 1})
+    save_checkpoint(path, {'next_eval_id': 2})
+    assert load_checkpoint(path) == {'next_eval_id': 2}
+
+
+def test_eval_log_append_read(tmp_path):
+    log = EvalLog(str(tmp_path / 'evals.jsonl'))
+    log.append(0, [1.0, 2.0], 'ok', [0.5, 1])
+    log.append(1, [3.0], 'no_trim', [0.25, 0])
+    entries = log.read()
+    log.close()
+    assert sorted(entries) == [0, 1]
+    assert entries[0] == {'eval_id': 0, 'score': [1.0, 2.0], 'status': 'ok', 'vector': [0.5, 1.0]}
+    assert entries[1]['status'] == 'no_trim'
+
+
+def test_eval_log_skips_cut_line(tmp_path):
+    path = str(tmp_path / 'evals.jsonl')
+    log = EvalLog(path)
+    log.append(0, [1.0], 'ok', [0.0])
+    log.close()
+    # crash of the head while writing the next line
+    with open(path, 'a') as fout:
+        fout.write('{"eval_id": 1, "score": [2.')
+    log = EvalLog(path)
+    assert sorted(log.read()) == [0]
+    log.close()
+
+
+def test_eval_log_truncate(tmp_path):
+    path = str(tmp_path / 'evals.jsonl')
+    log = EvalLog(path)
+    for eval_id in [0, 1, 2, 3]:
+        log.append(eval_id, [float(eval_id)], 'ok', [0.0])
+    log.close()
+    with open(path, 'a') as fout:
+        fout.write('{"eval_id": 4')
+
+    log = EvalLog(path)
+    entries = log.truncate(2)
+    assert sorted(entries) == [0, 1]
+    # eval ids after the checkpoint are given out again
+    log.append(2, [5.0], 'ok', [0.0])
+    entries = log.read()
+    log.close()
+    assert sorted(entries) == [0, 1, 2]
+    assert entries[2]['score'] == [5.0]
+    with open(path) as fin:
+        assert len(fin.readlines()) == 3
@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from design_vector import flatten_work, FlatPlan, structure_key, work_controls, CONTROL_KEYS
+
+
+def _work(seed=0):
+    rng = np.random.default_rng(seed)
+    return {'eval_id': 3 + seed,
+            'arm_length': float(rng.uniform(100, 300)),
+            'num_props': int(rng.integers(2, 8)),
+            'components': rng.integers(0, 20, size=4),
+            'lqr_vector1': rng.uniform(0, 1, size=5),
+            'lat_vel': [float(x) for x in rng.uniform(0, 50, size=4)],
+            'trim_discrete_baseline': [int(x) for x in rng.integers(0, 3, size=2)]}
+
+
+def test_flatten_matches_flatten_work():
+    plan = FlatPlan(_work())
+    works = [_work(seed) for seed in range(5)]
+    vectors = plan.flatten_batch(works)
+    assert vectors.shape == (5, plan.size)
+    assert vectors.dtype == np.float64
+    for work, vector in zip(works, vectors):
+        np.testing.assert_array_equal(vector, np.asarray(flatten_work(work), dtype=np.float64))
+    np.testing.assert_array_equal(plan.flatten(works[0]), vectors[0])
+
+
+def test_round_trip_keeps_types():
+    template = _work()
+    plan = FlatPlan(template)
+    work = _work(1)
+    value = plan.unflatten(plan.flatten(work))
+    assert 'eval_id' not in value
+    assert list(value) == [key for key in work if key != 'eval_id']
+    assert isinstance(value['arm_length'], float) and value['arm_length'] == work['arm_length']
+    assert isinstance(value['num_props'], int) and value['num_props'] == work['num_props']
+    assert value['components'].dtype == template['components'].dtype
+    np.testing.assert_array_equal(value['components'], work['components'])
+    np.testing.assert_array_equal(value['lqr_vector1'], work['lqr_vector1'])
+    assert value['lat_vel'] == work['lat_vel']
+    assert value['trim_discrete_baseline'] == work['trim_discrete_baseline']
+    assert all(isinstance(x, int) for x in value['trim_discrete_baseline'])
+
+    values = plan.unflatten_batch(plan.flatten_batch([work, template]))
+    assert values[0]['num_props'] == work['num_props']
+    assert values[1]['num_props'] == template['num_props']
+
+
+def test_schema_and_slots():
+    plan = FlatPlan(_work())
+    schema = plan.schema()
+    assert len(schema) == plan.size
+    assert list(schema[:3]) == ['arm_length', 'num_props', 'components[0]']
+    assert schema[-1] == 'trim_discrete_baseline[1]'
+    np.testing.assert_array_equal(plan.slots(['num_props', 'lat_vel']), [1, 11, 12, 13, 14])
+    assert plan.slots(['missing']).size == 0
+
+
+def test_empty_batch():
+    plan = FlatPlan(_work())
+    assert plan.flatten_batch([]).shape == (0, plan.size)
+
+
+def test_size_mismatch():
+    plan = FlatPlan(_work())
+    with pytest.raises(ValueError):
+        plan.unflatten(np.zeros(plan.size + 1))
+
+
+def _controlled_work(seed=0):
+    rng = np.random.default_rng(seed)
+    work = {'eval_id': seed, 'arm_length': 200.0, 'components': np.arange(4)}
+    for i in [1, 3, 4, 5]:
+        work['lqr_vector' + str(i)] = rng.uniform(0, 1, size=5)
+    work['lat_vel'] = rng.uniform(0, 50, size=4)
+    work['vert_vel'] = rng.uniform(0, 10, size=4)
+    return work
+
+
+def test_structure_key_ignores_controls():
+    key = structure_key(_controlled_work(0))
+    assert key == structure_key(_controlled_work(1))
+    hash(key)
+    work = _controlled_work(0)
+    work['components'] = np.arange(1, 5)
+    assert structure_key(work) != key
+    work = _controlled_work(0)
+    del work[CONTROL_KEYS[-1]]
+    assert structure_key(work) is None
+
+
+def test_work_controls():
+    work = _controlled_work()
+    controls = work_controls(work)
+    assert sorted(controls) == ['path1', 'path3', 'path4', 'path5']
+    assert controls['path4']['Q_angles'] == work['lqr_vector4'][3]
+    assert controls['path4']['latvel'] == work['lat_vel'][2]
+    assert controls['path5']['vertvel'] == work['vert_vel'][3]
@@ -0,0 +1,33 @@
+from eval_cache import EvalCache
+
+
+def test_get_returns_stored_status(tmp_path):
+    cache = EvalCache(str(tmp_path / 'evals.sqlite'))
+    key = EvalCache.make_key([1, 2.5, 3], 'trim', 'quad')
+    assert cache.get(key) == (None, None)
+    cache.put(key, 5 * [99999.], 'no_trim')
+    # existing entries are kept
+    cache.put(key, [1.0, 2.0, 3.0, 4.0, 5.0], 'ok')
+    assert cache.get(key) == (5 * [99999.], 'no_trim')
+    assert (cache.num_hits, cache.num_misses) == (1, 1)
+    cache.close()
+
+
+def test_key():
+    key = EvalCache.make_key([1, 2.5, 3], 'trim', 'quad')
+    # ints and floats of the same value hash the same
+    assert EvalCache.make_key([1.0, 2.5, 3.0], 'trim', 'quad') == key
+    assert EvalCache.make_key([1, 2.5, 3], 'all', 'quad') != key
+    assert EvalCache.make_key([1, 2.5, 3], 'trim', 'hex') != key
+
+
+def test_key_context(tmp_path):
+    from space_cache import space_id
+    acel = tmp_path / 'space.acel'
+    acel.write_text('a')
+    key = EvalCache.make_key([1, 2.5, 3], 'trim', 'quad', ['frac_speed_latvel', space_id(str(acel))])
+    assert EvalCache.make_key([1, 2.5, 3], 'trim', 'quad', ['frac_speed', space_id(str(acel))]) != key
+    other = tmp_path / 'other.acel'
+    other.write_text('b')
+    assert EvalCache.make_key([1, 2.5, 3], 'trim', 'quad', ['frac_speed_latvel', space_id(str(other))]) != key
+    assert EvalCache.make_key([1, 2.5, 3], 'trim', 'quad') != key
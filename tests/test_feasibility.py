@@ -0,0 +1,44 @@
+import numpy as np
+
+from feasibility import FeasibilityFilter, score_status
+from trim_scores import failure_score
+
+NO_TRIM_SCORE = failure_score('frac_speed_latvel')
+
+# number of choices of every component, as design_space in the configs
+DESIGN_SPACE = {'battery': ['Battery', 4], 'motor': ['Motor', 3]}
+
+
+def _work(battery, motor):
+    return {'battery0': battery, 'motor0': motor, 'motor1': motor, 'arm_length': 200.0}
+
+
+def test_score_status():
+    assert score_status(NO_TRIM_SCORE) == 'no_trim'
+    assert score_status([500.0, 0.0, 99999.0, -3000.0, 12.0]) == 'ok'
+
+
+def test_negative_cache():
+    feasibility = FeasibilityFilter(DESIGN_SPACE, seed=0)
+    feasibility.add(_work(1, 2), NO_TRIM_SCORE, 'no_trim')
+    # transient failures say nothing about the design
+    feasibility.add(_work(2, 2), NO_TRIM_SCORE, 'error')
+    feasibility.add(_work(3, 0), [0.0, 0.0, 0.0, -3000.0, 12.0], 'ok')
+    assert feasibility.check(_work(1, 2)) == 'cache'
+    assert feasibility.check(_work(2, 2)) is None
+    assert feasibility.check(_work(3, 0)) is None
+    assert feasibility.labels == [False, True]
+
+
+def test_classifier():
+    feasibility = FeasibilityFilter(DESIGN_SPACE, min_samples=40, audit=0.0, seed=0)
+    rng = np.random.RandomState(0)
+    for _ in range(60):
+        battery, motor = rng.randint(4), rng.randint(3)
+        # battery 0 never trims
+        if battery == 0:
+            feasibility.add(_work(battery, motor), NO_TRIM_SCORE, 'no_trim')
+        else:
+            feasibility.add(_work(battery, motor), [0.0, 0.0, 0.0, -3000.0, 12.0], 'ok')
+    assert feasibility.feasible_prob(_work(0, 1)) < feasibility.feasible_prob(_work(2, 1))
+    assert feasibility.feasible_prob(_work(2, 1)) > 0.5
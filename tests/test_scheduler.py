@@ -0,0 +1,144 @@
+import os
+import time
+
+import pytest
+
+ray = pytest.importorskip('ray')
+
+from conftest import ES_DIR
+from scheduler import Scheduler, ScheduledRun
+from eval_result import EvalResult
+
+
+@pytest.fixture(scope='module', autouse=True)
+def ray_local():
+    # workers import the remote classes of this module and the es modules by name
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    ray.init(num_cpus=4, include_dashboard=False, log_to_driver=False,
+             runtime_env={'env_vars': {'PYTHONPATH': os.pathsep.join([ES_DIR, tests_dir])}})
+    yield
+    ray.shutdown()
+
+
+@ray.remote(num_cpus=0)
+class SleepWorker:
+    """
+    Scores a candidate with its value, the first worker is slow to produce stragglers
+    """
+    def __init__(self, worker_id, slow=0.0):
+        self.worker_id = worker_id
+        self.slow = slow
+        self.num_evals = 0
+
+    def run(self, cand):
+        self.num_evals += 1
+        if self.worker_id == 0:
+            time.sleep(self.slow)
+        return EvalResult(cand, self.worker_id, [float(cand)], info={'rss': self.num_evals * 2 ** 20})
+
+    def flush(self):
+        pass
+
+
+def _make_run(budget, name='run', lookup=None, copies=None, start=0):
+    # the scheduler tracks candidates by identity, runs sharing the pool need distinct
+    # candidate objects, as the parameters asked from separate optimizers are
+    told = []
+
+    def ask():
+        cand = next(ids)
+        return cand
+
+    def submit(worker, cand):
+        return worker.run.remote(cand)
+
+    def submit_copy(worker, cand):
+        copies.append(cand)
+        return worker.run.remote(cand)
+
+    def tell(cand, result):
+        assert result.score == [float(cand)]
+        told.append(cand)
+        return float(cand)
+
+    ids = iter(range(start, start + 10 ** 6))
+    run = ScheduledRun(name, ask, submit, tell, budget, lookup=lookup,
+                       submit_copy=submit_copy if copies is not None else None)
+    return run, told
+
+
+@pytest.mark.parametrize('mode', ['batch', 'async'])
+@pytest.mark.parametrize('evals_per_worker', [1, 2])
+def test_exact_budget(mode, evals_per_worker):
+    workers = [SleepWorker.remote(i) for i in range(3)]
+    run, told = _make_run(17)
+    Scheduler(workers, mode, evals_per_worker).run_portfolio([run])
+    assert run.num_asked == 17
+    assert run.num_told == 17
+    assert sorted(told) == list(range(17))
+    assert run.num_in_flight == 0
+
+
+@pytest.mark.parametrize('mode', ['batch', 'async'])
+def test_portfolio_budgets(mode):
+    workers = [SleepWorker.remote(i) for i in range(3)]
+    runs = [_make_run(budget, name=str(budget), start=1000 * (i + 1)) for i, budget in enumerate([5, 11, 20])]
+    Scheduler(workers, mode).run_portfolio([run for run, _ in runs])
+    for (run, told), start in zip(runs, [1000, 2000, 3000]):
+        assert run.num_told == run.budget
+        assert sorted(told) == list(range(start, start + run.budget))
+
+
+@pytest.mark.parametrize('mode', ['batch', 'async'])
+def test_lookup_is_told_without_worker(mode):
+    workers = [SleepWorker.remote(i) for i in range(2)]
+    # even candidates are known, e.g. from the eval cache
+    run, told = _make_run(10, lookup=lambda cand: EvalResult(cand, -1, [float(cand)], info={'cached': True}) if cand % 2 == 0 else None)
+    Scheduler(workers, mode).run_portfolio([run])
+    assert sorted(told) == list(range(10))
+    assert run.num_in_flight == 0
+
+
+@pytest.mark.parametrize('mode', ['batch', 'async'])
+def test_speculation_tells_every_candidate_once(mode):
+    workers = [SleepWorker.remote(0, slow=0.3)] + [SleepWorker.remote(i) for i in range(1, 4)]
+    copies = []
+    run, told = _make_run(12, copies=copies)
+    Scheduler(workers, mode, speculative=True).run_portfolio([run])
+    assert sorted(told) == list(range(12))
+    assert run.num_told == 12
+    # stragglers of the slow worker got copies on the idle ones
+    assert copies
+
+
+@pytest.mark.parametrize('mode', ['batch', 'async'])
+def test_recycle_after(mode):
+    workers = [SleepWorker.remote(i) for i in range(2)]
+    replaced = []
+
+    def recycle(worker):
+        new_worker = SleepWorker.remote(len(workers) + len(replaced))
+        replaced.append(worker)
+        return new_worker
+
+    run, told = _make_run(12)
+    scheduler = Scheduler(workers, mode, recycle=recycle, recycle_after=3)
+    scheduler.run_portfolio([run])
+    assert sorted(told) == list(range(12))
+    assert replaced
+    assert len(scheduler.slots) == 2
+    assert not any([worker in scheduler.slots for worker in replaced])
+
+
+def test_async_stops_when_no_run_can_ask():
+    workers = [SleepWorker.remote(0)]
+    run, told = _make_run(5)
+    # every candidate was asked, but none is in flight, e.g. after an ask that raised
+    run.num_asked = 5
+    Scheduler(workers, 'async').run_portfolio([run])
+    assert told == []
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        Scheduler([], 'sync')
@@ -0,0 +1,40 @@
+import numpy as np
+
+from successive_halving import promote, rung_losses
+
+# loss of a failed path simulation, 1600 minus the error score of every path
+WORST_PATH_LOSS = 1600.0 + 4 * 1000.0
+
+
+def test_promote_best_trimmed():
+    trim_losses = np.array([5.0, -3000.0, 2.0, -100.0, 7.0])
+    trimmed = [True, False, True, True, True]
+    assert promote(trim_losses, trimmed, 0.5) == [3, 2]
+    assert promote(trim_losses, trimmed, 0.0) == [3]
+    assert promote(trim_losses, 5 * [False], 0.5) == []
+
+
+def test_rejected_rank_after_promoted():
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        # frac_speed_latvel trim losses, -300 * speed makes the losses of fast designs very negative
+        trim_losses = np.concatenate([rng.uniform(-15000.0, 2000.0, size=30), [4 * 99999.0]])
+        trimmed = [True] * 30 + [False]
+        promoted = promote(trim_losses, trimmed, 0.25)
+        # path losses anywhere from a perfect design to a failed one
+        path_losses = {i: rng.uniform(0.0, WORST_PATH_LOSS) for i in promoted}
+        losses = rung_losses(trim_losses, path_losses, WORST_PATH_LOSS)
+
+        rejected = [i for i in range(len(trim_losses)) if i not in path_losses]
+        assert np.min(losses[rejected]) > WORST_PATH_LOSS
+        assert np.min(losses[rejected]) > np.max(losses[promoted])
+        for i, loss in path_losses.items():
+            assert losses[i] == loss
+        # rejected designs keep their trim ranking
+        order = np.argsort(trim_losses[rejected], kind='stable')
+        assert np.all(np.diff(losses[rejected][order]) >= 0.0)
+
+
+def test_rejected_rank_after_unexpected_path_loss():
+    losses = rung_losses(np.array([-5000.0, 10.0]), {1: WORST_PATH_LOSS + 50.0}, WORST_PATH_LOSS)
+    assert losses[0] > losses[1]
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+import trim_scores
+from trim_scores import score_batch, score_trims, stack_trims, NO_TRIM, TRIMS
+from sim_responses import compact_responses, FRAC_COLUMNS
+
+NUM_SCORES = {'frac_speed_latvel': 5, 'frac_speed': 4, 'distance_time_frac': 8}
+
+
+def _reference_score(name, responses):
+    # pandas scoring of the workers before the registry
+    if not bool(responses):
+        return NUM_SCORES[name] * [NO_TRIM]
+    forward, turn_500, turn_300 = [responses[trim] for trim in TRIMS]
+    frac = [500.0 * (df[FRAC_COLUMNS] >= 1.0).sum().sum() for df in [forward, turn_500, turn_300]]
+    if name == 'distance_time_frac':
+        score = [2000.0 - forward['Distance'].max(), 410.0 - forward['Flight time'].max(), frac[0],
+                 3142.0 - turn_500['Distance'].max(), frac[1],
+                 3500.0 - turn_300['Distance'].max(), - turn_300['Speed'].max(), frac[2]]
+    else:
+        score = frac + [-300 * turn_300['Speed'].max()]
+        if name == 'frac_speed_latvel':
+            score.append(max(turn_500['Speed'].max(), turn_300['Speed'].max()))
+    if np.any(np.isnan(score)):
+        return NUM_SCORES[name] * [NO_TRIM]
+    return score
+
+
+def _responses(seed, num_rows=None):
+    rng = np.random.default_rng(seed)
+    responses = {}
+    for trim in TRIMS:
+        n = num_rows if num_rows is not None else int(rng.integers(1, 12))
+        df = pd.DataFrame({'Distance': rng.uniform(0, 4000, n), 'Flight time': rng.uniform(0, 500, n),
+                           'Speed': rng.uniform(0, 50, n)})
+        for column in FRAC_COLUMNS:
+            df[column] = rng.uniform(0.5, 1.5, n)
+        # failed trim points are nan
+        df.loc[rng.uniform(size=n) < 0.2, 'Speed'] = np.nan
+        responses[trim] = df
+    return responses
+
+
+@pytest.fixture(params=['numpy', 'loops'])
+def reduce(request, monkeypatch):
+    monkeypatch.setattr(trim_scores, '_reduce', {'numpy': trim_scores._reduce_numpy,
+                                                 'loops': trim_scores._reduce_loops}[request.param])
+
+
+@pytest.mark.parametrize('name', sorted(NUM_SCORES))
+def test_matches_reference(name, reduce):
+    responses_list = [_responses(seed) for seed in range(20)] + [{}]
+    expected = np.asarray([_reference_score(name, responses) for responses in responses_list])
+    # DataFrame tables as loaded offline, compact tables as sent by the simulation child
+    np.testing.assert_allclose(score_batch(name, responses_list), expected)
+    np.testing.assert_allclose(score_batch(name, [compact_responses(r) for r in responses_list]), expected)
+    assert score_trims(name, responses_list[0]) == pytest.approx(expected[0].tolist())
+
+
+def test_nan_objective(reduce):
+    responses = _responses(0, num_rows=3)
+    # no function scores the forward speed
+    responses['forward']['Speed'] = np.nan
+    assert NO_TRIM not in score_trims('frac_speed_latvel', responses)
+    responses['turn_300']['Speed'] = np.nan
+    assert score_trims('frac_speed_latvel', responses) == 5 * [NO_TRIM]
+    assert score_trims('distance_time_frac', responses) == 8 * [NO_TRIM]
+
+
+def test_padding():
+    tables, found = stack_trims([compact_responses(_responses(0, num_rows=2)), {},
+                                 compact_responses(_responses(1, num_rows=5))])
+    assert tables.shape == (3, len(TRIMS), 5, 6)
+    np.testing.assert_array_equal(found, [True, False, True])
+    assert np.all(np.isnan(tables[0, :, 2:]))
+
+
+def test_empty_batch(reduce):
+    assert score_batch('distance_time_frac', []).shape == (0, 8)
+
+
+@pytest.mark.parametrize('name', sorted(NUM_SCORES))
+def test_failure_score(name):
+    assert trim_scores.failure_score(name) == NUM_SCORES[name] * [NO_TRIM]
+    assert trim_scores.failure_score(name, trim_scores.TIMEOUT) == NUM_SCORES[name] * [trim_scores.TIMEOUT]
+    # failed evaluations stack with scored ones in the result files
+    scores = [score_trims(name, _responses(0)), trim_scores.failure_score(name)]
+    assert np.asarray(scores).shape == (2, NUM_SCORES[name])